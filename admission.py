@@ -0,0 +1,93 @@
+import threading
+import time
+from config import Config
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted within its queue budget"""
+    
+    def __init__(self, route_class, retry_after):
+        super().__init__(f"Server busy ({route_class})")
+        self.route_class = route_class
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """Per-route concurrency limits and bounded, prioritised wait queues"""
+    
+    def __init__(self, max_active=Config.ADMISSION_MAX_ACTIVE, classes=None):
+        self.max_active = max_active
+        self.classes = classes or Config.ADMISSION_CLASSES
+        self.active = 0
+        self.route_active = {name: 0 for name in self.classes}
+        self.route_waiting = {name: 0 for name in self.classes}
+        self.admitted = {name: 0 for name in self.classes}
+        self.rejected = {name: 0 for name in self.classes}
+        self._condition = threading.Condition()
+    
+    def classify(self, method, path):
+        """Map a request to its route class"""
+        for route_class, settings in self.classes.items():
+            if (method, path) in settings.get('routes', ()):
+                return route_class
+        return 'default'
+    
+    def _can_run(self, route_class):
+        return (self.active < self.max_active and
+                self.route_active[route_class] < self.classes[route_class]['limit'])
+    
+    def _outranked(self, route_class):
+        """A higher priority class is waiting and could use the free slot"""
+        priority = self.classes[route_class]['priority']
+        return any(self.route_waiting[other] and settings['priority'] < priority and
+                   self.route_active[other] < settings['limit']
+                   for other, settings in self.classes.items())
+    
+    def acquire(self, route_class):
+        """Wait for a slot or raise AdmissionRejected"""
+        settings = self.classes[route_class]
+        with self._condition:
+            if self._can_run(route_class) and not self._outranked(route_class):
+                self._admit(route_class)
+                return
+            
+            if self.route_waiting[route_class] >= settings['queue']:
+                self.rejected[route_class] += 1
+                raise AdmissionRejected(route_class, settings['retry_after'])
+            
+            deadline = time.monotonic() + settings['wait']
+            self.route_waiting[route_class] += 1
+            try:
+                while not (self._can_run(route_class) and not self._outranked(route_class)):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[route_class] += 1
+                        raise AdmissionRejected(route_class, settings['retry_after'])
+                    self._condition.wait(remaining)
+            finally:
+                self.route_waiting[route_class] -= 1
+            self._admit(route_class)
+    
+    def _admit(self, route_class):
+        self.active += 1
+        self.route_active[route_class] += 1
+        self.admitted[route_class] += 1
+    
+    def release(self, route_class):
+        """Free the slot taken by acquire"""
+        with self._condition:
+            self.active -= 1
+            self.route_active[route_class] -= 1
+            self._condition.notify_all()
+    
+    def get_stats(self):
+        """Current load and admission counters per route class"""
+        with self._condition:
+            return {
+                'active': self.active,
+                'max_active': self.max_active,
+                'classes': {name: {
+                    'active': self.route_active[name],
+                    'waiting': self.route_waiting[name],
+                    'admitted': self.admitted[name],
+                    'rejected': self.rejected[name]
+                } for name in self.classes}
+            }
@@ -0,0 +1,252 @@
+import sqlite3
+import threading
+from array import array
+from collections import OrderedDict
+from datetime import date
+from config import Config
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the array module is the fallback
+    np = None
+
+DAY_NAMES = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+def _take(values, indices):
+    """Gather values at indices"""
+    if np is not None:
+        return np.asarray(values)[np.asarray(indices)]
+    return array('l', [values[i] for i in indices])
+
+def _bincount(indices, minlength):
+    """Count occurrences of each index in range(minlength)"""
+    if np is not None:
+        if not len(indices):
+            return [0] * minlength
+        return np.bincount(np.asarray(indices), minlength=minlength).tolist()
+    counts = [0] * minlength
+    for i in indices:
+        counts[i] += 1
+    return counts
+
+def _bincount2d(rows, cols, nrows, ncols):
+    """Count (row, col) pairs into an nrows x ncols grid"""
+    if np is not None:
+        flat = np.asarray(rows) * ncols + np.asarray(cols)
+    else:
+        flat = array('l', [r * ncols + c for r, c in zip(rows, cols)])
+    counts = _bincount(flat, nrows * ncols)
+    return [counts[r * ncols:(r + 1) * ncols] for r in range(nrows)]
+
+class AttendanceColumns:
+    """Array-backed columns of attendance data for one class and term"""
+    
+    def __init__(self, class_id, students):
+        self.class_id = class_id
+        self.students = students  # list of dicts with id, username, full_name
+        self.student_index = {student['id']: i for i, student in enumerate(students)}
+        
+        # One entry per attendance session
+        self.session_ids = array('l')
+        self.session_day = array('l')  # date ordinal
+        self.session_weekday = array('l')
+        self.session_hour = array('l')
+        
+        # One entry per attendance record
+        self.record_session = array('l')  # index into the session columns
+        self.record_student = array('l')  # index into students
+    
+    def add_session(self, session_id, session_date, start_time):
+        try:
+            day = date.fromisoformat(session_date)
+            hour = int((start_time or '0')[:2])
+        except (TypeError, ValueError):
+            return
+        self.session_ids.append(session_id)
+        self.session_day.append(day.toordinal())
+        self.session_weekday.append(day.weekday())
+        self.session_hour.append(hour)
+    
+    def add_record(self, session_position, student_id):
+        student_position = self.student_index.get(student_id)
+        if student_position is not None:
+            self.record_session.append(session_position)
+            self.record_student.append(student_position)
+    
+    def session_weeks(self):
+        """Monday ordinal of each session's week and the sorted distinct weeks"""
+        week_starts = array('l', [day - weekday for day, weekday
+                                  in zip(self.session_day, self.session_weekday)])
+        weeks = sorted(set(week_starts))
+        week_position = {week: i for i, week in enumerate(weeks)}
+        return array('l', [week_position[week] for week in week_starts]), weeks
+
+class AttendanceAnalytics:
+    def __init__(self, db):
+        self.db = db
+        self._cache = OrderedDict()
+        self._column_cache = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _data_version(self, conn):
+        """Cheap marker that changes whenever sessions or records are added"""
+        row = conn.execute('''SELECT (SELECT MAX(id) FROM attendance_records),
+                                     (SELECT MAX(id) FROM attendance_sessions)''').fetchone()
+        return tuple(row)
+    
+    def _cached(self, key, compute):
+        """Return cached result for key, recomputing when new data has arrived"""
+        with self.db.read_snapshot() as conn:
+            if not conn:
+                return None
+            
+            try:
+                version = self._data_version(conn)
+                with self._lock:
+                    entry = self._cache.get(key)
+                    if entry and entry[0] == version:
+                        self._cache.move_to_end(key)
+                        return entry[1]
+                
+                value = compute(conn, version)
+            except sqlite3.Error as e:
+                print(f"Analytics error: {e}")
+                return None
+        
+        with self._lock:
+            self._cache[key] = (version, value)
+            self._cache.move_to_end(key)
+            while len(self._cache) > Config.ANALYTICS_CACHE_SIZE:
+                self._cache.popitem(last=False)
+        return value
+    
+    def _columns(self, conn, version, class_id, start_date=None, end_date=None):
+        """Columns for a class and term, shared by every aggregate until new data arrives"""
+        key = (class_id, start_date, end_date)
+        with self._lock:
+            entry = self._column_cache.get(key)
+            if entry and entry[0] == version:
+                self._column_cache.move_to_end(key)
+                return entry[1]
+        
+        columns = self._load_columns(conn, class_id, start_date, end_date)
+        with self._lock:
+            self._column_cache[key] = (version, columns)
+            while len(self._column_cache) > Config.ANALYTICS_CACHE_SIZE:
+                self._column_cache.popitem(last=False)
+        return columns
+    
+    def _term_filter(self, prefix, class_id, start_date=None, end_date=None):
+        """WHERE clause selecting a class's sessions within an optional term"""
+        conditions = f"{prefix}class_id = ?"
+        params = [class_id]
+        if start_date:
+            conditions += f" AND {prefix}session_date >= ?"
+            params.append(start_date)
+        if end_date:
+            conditions += f" AND {prefix}session_date <= ?"
+            params.append(end_date)
+        return conditions, params
+    
+    def _load_columns(self, conn, class_id, start_date=None, end_date=None):
+        """Load a class (optionally limited to a term) into columns"""
+        students = [dict(row) for row in conn.execute(
+            '''SELECT id, username, full_name FROM users
+               WHERE role = 'student' ORDER BY id''')]
+        columns = AttendanceColumns(class_id, students)
+        
+        conditions, params = self._term_filter('', class_id, start_date, end_date)
+        for row in conn.execute(f'''SELECT id, session_date, start_time FROM attendance_sessions
+                                    WHERE {conditions} ORDER BY id''', params):
+            columns.add_session(row['id'], row['session_date'], row['start_time'])
+        
+        session_position = {session_id: i for i, session_id in enumerate(columns.session_ids)}
+        conditions, params = self._term_filter('ass.', class_id, start_date, end_date)
+        for row in conn.execute(f'''SELECT ar.session_id, ar.student_id FROM attendance_records ar
+                                    JOIN attendance_sessions ass ON ass.id = ar.session_id
+                                    WHERE {conditions}''', params):
+            position = session_position.get(row['session_id'])
+            if position is not None:
+                columns.add_record(position, row['student_id'])
+        
+        return columns
+    
+    def weekly_trends(self, class_id, start_date=None, end_date=None):
+        """Attendance rate per student for each week"""
+        def compute(conn, version):
+            columns = self._columns(conn, version, class_id, start_date, end_date)
+            session_week, weeks = columns.session_weeks()
+            sessions_per_week = _bincount(session_week, len(weeks))
+            attended = _bincount2d(columns.record_student, _take(session_week, columns.record_session),
+                                   len(columns.students), len(weeks))
+            
+            return {
+                'weeks': [date.fromordinal(week).isoformat() for week in weeks],
+                'students': [{
+                    'username': student['username'],
+                    'full_name': student['full_name'],
+                    'rates': [round(count * 100.0 / total, 1) if total else None
+                              for count, total in zip(attended[i], sessions_per_week)]
+                } for i, student in enumerate(columns.students)]
+            }
+        
+        return self._cached(('weekly', class_id, start_date, end_date), compute)
+    
+    def heatmap(self, class_id, start_date=None, end_date=None):
+        """Day-of-week by hour-of-day attendance rate grid"""
+        def compute(conn, version):
+            columns = self._columns(conn, version, class_id, start_date, end_date)
+            sessions = _bincount2d(columns.session_weekday, columns.session_hour, 7, 24)
+            records = _bincount2d(_take(columns.session_weekday, columns.record_session),
+                                  _take(columns.session_hour, columns.record_session), 7, 24)
+            student_count = len(columns.students)
+            
+            return {
+                'days': DAY_NAMES,
+                'sessions': sessions,
+                'attendance': records,
+                'rates': [[round(records[d][h] * 100.0 / (sessions[d][h] * student_count), 1)
+                           if sessions[d][h] and student_count else None
+                           for h in range(24)] for d in range(7)]
+            }
+        
+        return self._cached(('heatmap', class_id, start_date, end_date), compute)
+    
+    def student_rates(self, class_id, start_date=None, end_date=None):
+        """Overall attendance rate per student"""
+        def compute(conn, version):
+            columns = self._columns(conn, version, class_id, start_date, end_date)
+            total = len(columns.session_ids)
+            attended = _bincount(columns.record_student, len(columns.students))
+            return [{
+                'username': student['username'],
+                'full_name': student['full_name'],
+                'sessions_attended': attended[i],
+                'total_sessions': total,
+                'attendance_rate': round(attended[i] * 100.0 / total, 1) if total else 0.0
+            } for i, student in enumerate(columns.students)]
+        
+        return self._cached(('rates', class_id, start_date, end_date), compute)
+    
+    def at_risk(self, class_id, threshold=Config.ANALYTICS_AT_RISK_THRESHOLD,
+                start_date=None, end_date=None):
+        """Students whose attendance rate is below threshold, lowest first"""
+        rates = self.student_rates(class_id, start_date, end_date) or []
+        flagged = [student for student in rates
+                   if student['total_sessions'] and student['attendance_rate'] < threshold]
+        return sorted(flagged, key=lambda student: student['attendance_rate'])
+    
+    def compare_classes(self, class_ids, start_date=None, end_date=None):
+        """Average attendance rate and volume for each class"""
+        comparison = []
+        for class_id in class_ids:
+            rates = self.student_rates(class_id, start_date, end_date) or []
+            total_sessions = rates[0]['total_sessions'] if rates else 0
+            comparison.append({
+                'class_id': class_id,
+                'total_sessions': total_sessions,
+                'total_records': sum(student['sessions_attended'] for student in rates),
+                'average_rate': round(sum(student['attendance_rate'] for student in rates) / len(rates), 1)
+                                if rates and total_sessions else 0.0
+            })
+        return comparison
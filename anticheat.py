@@ -0,0 +1,146 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from config import Config
+
+class _SessionState:
+    """Bounded per-session detector state"""
+    
+    def __init__(self):
+        self.students_by_ip = OrderedDict()
+        self.students_by_device = OrderedDict()
+        self.marks_by_key = OrderedDict()
+        self.flagged = set()
+
+class AdvancedAntiCheat:
+    def __init__(self, db=None, security=None):
+        self.db = db
+        self.security = security
+        self.sessions = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def device_fingerprint(self, device_id):
+        """Short stable fingerprint for a scanner's device id"""
+        return hashlib.sha256((device_id or '').encode()).hexdigest()[:16]
+    
+    def observe(self, session_id, student_id, ip_address="", device_id="", now=None, live=True):
+        """Feed one successful attendance mark and return any new flags"""
+        now = time.time() if now is None else now
+        flags = []
+        
+        with self._lock:
+            state = self._get_state(session_id)
+            
+            # User-Agents are shared by every student on the same phone model, so only
+            # the scanner's own stored id identifies a device
+            fingerprint = self.device_fingerprint(device_id) if device_id else None
+            ip_key = ip_address if Config.ANTICHEAT_IP_CHECKS else None
+            self._track(state, state.students_by_ip, 'shared_ip', ip_key,
+                        student_id, Config.ANTICHEAT_MAX_STUDENTS_PER_IP, session_id, flags)
+            self._track(state, state.students_by_device, 'shared_device', fingerprint,
+                        student_id, Config.ANTICHEAT_MAX_STUDENTS_PER_DEVICE, session_id, flags)
+            
+            # Bursts are per source, so a busy lecture hall is not a burst on its own.
+            # Queued offline scans arrive out of order and stay out of the live window.
+            if live:
+                self._burst(state, 'ip_burst', ip_key, student_id, now, session_id, flags)
+                self._burst(state, 'device_burst', fingerprint, student_id, now, session_id, flags)
+        
+        for flag in flags:
+            self._report(flag, ip_address)
+        return flags
+    
+    def flag_late_scan(self, session_id, student_id, ip_address, scanned_at, session_end, now=None):
+        """Flag an offline scan submitted well after its attendance session ended"""
+        now = time.time() if now is None else now
+        flag = {
+            'session_id': session_id,
+            'type': 'late_offline_scan',
+            'key': ip_address,
+            'student_id': student_id,
+            'details': {'scanned_at': round(scanned_at), 'session_end': round(session_end),
+                        'submitted_after_end': round(now - session_end)}
+        }
+        self._report(flag, ip_address)
+        return flag
+    
+    def _get_state(self, session_id):
+        state = self.sessions.get(session_id)
+        if state is None:
+            state = self.sessions[session_id] = _SessionState()
+            if len(self.sessions) > Config.ANTICHEAT_MAX_SESSIONS:
+                self.sessions.popitem(last=False)
+        else:
+            self.sessions.move_to_end(session_id)
+        return state
+    
+    def _track(self, state, students_by_key, flag_type, key, student_id, limit, session_id, flags):
+        """Count distinct students per key, flagging once when limit is passed"""
+        if not key:
+            return
+        
+        students = students_by_key.get(key)
+        if students is None:
+            students = students_by_key[key] = set()
+            if len(students_by_key) > Config.ANTICHEAT_MAX_KEYS:
+                evicted_key, _ = students_by_key.popitem(last=False)
+                state.flagged.discard((flag_type, evicted_key))
+        else:
+            students_by_key.move_to_end(key)
+        
+        # Sets stop growing once a key has been flagged
+        if (flag_type, key) in state.flagged:
+            return
+        
+        students.add(student_id)
+        if len(students) > limit:
+            state.flagged.add((flag_type, key))
+            flags.append({
+                'session_id': session_id,
+                'type': flag_type,
+                'key': key,
+                'student_id': student_id,
+                'details': {'students': sorted(students)}
+            })
+            students.clear()
+    
+    def _burst(self, state, flag_type, key, student_id, now, session_id, flags):
+        """Flag a single IP or device marking too many students in a short window"""
+        if not key:
+            return
+        
+        entry = state.marks_by_key.get((flag_type, key))
+        if entry is None:
+            # [recent (time, student) marks, time of last flag]
+            entry = state.marks_by_key[(flag_type, key)] = [deque(), 0]
+            if len(state.marks_by_key) > 2 * Config.ANTICHEAT_MAX_KEYS:
+                state.marks_by_key.popitem(last=False)
+        else:
+            state.marks_by_key.move_to_end((flag_type, key))
+        
+        marks = entry[0]
+        marks.append((now, student_id))
+        while marks and marks[0][0] <= now - Config.ANTICHEAT_BURST_WINDOW:
+            marks.popleft()
+        if (len(marks) > Config.ANTICHEAT_BURST_LIMIT and
+                now - entry[1] > Config.ANTICHEAT_BURST_WINDOW):
+            entry[1] = now
+            # The burst belongs to the source, not to whichever student crossed the limit
+            flags.append({
+                'session_id': session_id,
+                'type': flag_type,
+                'key': key,
+                'student_id': None,
+                'details': {'marks': len(marks), 'window_seconds': Config.ANTICHEAT_BURST_WINDOW,
+                            'students': sorted({marked for _, marked in marks})}
+            })
+    
+    def _report(self, flag, ip_address):
+        """Write flag where teachers can review it"""
+        if self.db:
+            self.db.save_attendance_flag(flag)
+        if self.security:
+            self.security.record_suspicious_activity(
+                f"Attendance anomaly ({flag['type']}) in session {flag['session_id']}",
+                ip_address, flag['student_id'])
@@ -22,21 +22,20 @@ class AdvancedAuth:
             'last_activity': time.time()
         }
         
-        # Cleanup old sessions
-        self.cleanup_sessions()
+        # Expired sessions are purged by the maintenance scheduler
         return session_id
     
     def verify_session(self, session_id):
         """Verify session with activity tracking"""
-        if session_id in self.sessions:
-            session = self.sessions[session_id]
-            
+        # Single lookup, since the maintenance scheduler may purge it concurrently
+        session = self.sessions.get(session_id)
+        if session is not None:
             # Update last activity
             session['last_activity'] = time.time()
             
             # Check if session expired
             if time.time() - session['created_at'] > self.session_timeout:
-                del self.sessions[session_id]
+                self.sessions.pop(session_id, None)
                 return None
             
             return session
@@ -44,8 +43,7 @@ class AdvancedAuth:
     
     def logout(self, session_id):
         """Logout user and clear session"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        self.sessions.pop(session_id, None)
     
     def record_login_attempt(self, username, success):
         """Track login attempts for security"""
@@ -76,9 +74,9 @@ class AdvancedAuth:
         """Clean up expired sessions"""
         current_time = time.time()
         expired_sessions = [
-            sid for sid, session in self.sessions.items()
+            sid for sid, session in list(self.sessions.items())
             if current_time - session['created_at'] > self.session_timeout
         ]
         
         for sid in expired_sessions:
-            del self.sessions[sid]
+            self.sessions.pop(sid, None)
@@ -11,3 +11,81 @@ class Config:
     # Security settings
     MAX_LOGIN_ATTEMPTS = 3
     PASSWORD_MIN_LENGTH = 6
+    TRUSTED_PROXIES = ()  # Proxy IPs whose X-Forwarded-For / X-Real-IP headers are honoured
+    
+    # Security monitoring settings
+    SECURITY_EVENT_CAPACITY = 100  # Recent events kept in memory
+    SECURITY_WINDOW_SECONDS = 600  # Sliding window for offender counters
+    SECURITY_WINDOW_BUCKETS = 10
+    SECURITY_MAX_TRACKED_KEYS = 1000  # Per-IP / per-student counters kept
+    SECURITY_PERSIST_EVENTS = True
+    SECURITY_PENDING_LIMIT = 1000  # Unsaved events kept for the flush task; oldest dropped past this
+    SECURITY_EVENT_RETENTION_DAYS = 90  # Persisted events older than this are pruned
+    
+    # Anti-cheat detector settings
+    ANTICHEAT_MAX_SESSIONS = 50  # Attendance sessions tracked at once
+    ANTICHEAT_MAX_KEYS = 500  # IPs / devices tracked per session
+    ANTICHEAT_DEVICE_ID_LENGTH = 64  # Longest device id accepted from a scanner
+    ANTICHEAT_IP_CHECKS = False  # Shared-IP checks misfire behind campus NAT; enable only without one
+    ANTICHEAT_MAX_STUDENTS_PER_IP = 4
+    ANTICHEAT_MAX_STUDENTS_PER_DEVICE = 2  # Keyed on the scanner's stored device id
+    ANTICHEAT_BURST_WINDOW = 5  # seconds
+    ANTICHEAT_BURST_LIMIT = 8  # marks per IP / device per burst window
+    
+    # Offline batch submission settings
+    BATCH_MAX_ITEMS = 50
+    OFFLINE_SCAN_MAX_AGE = 7200  # Queued scans older than 2 hours are rejected
+    SCAN_CLOCK_SKEW = 30  # Allowed device clock drift in seconds
+    OFFLINE_SCAN_LATE_GRACE = 900  # Scans submitted this long after their session ended are flagged for review
+    
+    # Reporting read path settings
+    READ_POOL_SIZE = 2  # Concurrent reporting queries
+    READ_ACQUIRE_TIMEOUT = 2.0  # seconds to wait for a free read connection
+    READ_QUERY_TIMEOUT = 5.0  # seconds before a reporting query is interrupted
+    READ_BUSY_RETRY_AFTER = 5  # seconds clients are told to wait when reports are busy
+    
+    # Analytics settings
+    ANALYTICS_AT_RISK_THRESHOLD = 75.0  # percent
+    ANALYTICS_CACHE_SIZE = 32
+    
+    # QR image settings
+    QR_ROTATION_INTERVAL = 60  # seconds each displayed code stays the same
+    QR_IMAGE_CACHE_SIZE = 64
+    
+    # Background maintenance settings
+    MAINTENANCE_JITTER = 0.1  # +/- fraction of each task interval
+    AUTH_CLEANUP_INTERVAL = 60
+    QR_CLEANUP_INTERVAL = 30
+    SESSION_CLOSE_INTERVAL = 60
+    SUMMARY_REFRESH_INTERVAL = 300
+    LOG_FLUSH_INTERVAL = 5
+    SECURITY_PRUNE_INTERVAL = 3600
+    LOG_BUFFER_LIMIT = 10000  # Oldest buffered log entries are dropped past this
+    ATTENDANCE_SESSION_DURATION = 5400  # Sessions auto-close after 90 minutes
+    
+    # Admission control settings (lower priority number wins free slots)
+    ADMISSION_MAX_ACTIVE = 32  # Requests handled at once across all routes
+    ADMISSION_CLASSES = {
+        'scan': {
+            'routes': (('POST', '/mark_attendance'), ('POST', '/mark_attendance_batch')),
+            'limit': 24, 'queue': 200, 'wait': 3.0, 'priority': 0, 'retry_after': 1
+        },
+        'default': {
+            'routes': (),
+            'limit': 16, 'queue': 32, 'wait': 2.0, 'priority': 1, 'retry_after': 2
+        },
+        'report': {
+            'routes': (('GET', '/report'), ('GET', '/analytics')),
+            'limit': 2, 'queue': 4, 'wait': 1.0, 'priority': 2, 'retry_after': 5
+        },
+        'security': {
+            'routes': (('GET', '/security'),),
+            'limit': 1, 'queue': 2, 'wait': 1.0, 'priority': 2, 'retry_after': 5
+        },
+    }
+    
+    # Request trace recording (opt-in)
+    TRACE_ENABLED = False
+    TRACE_FILE = "request_trace_{started}.jsonl.gz"
+    TRACE_FLUSH_BATCH = 100
+    TRACE_QUERY_KEYS = ('view',)  # Query values safe to keep for replay
@@ -1,10 +1,25 @@
 import sqlite3
 import hashlib
 import json
+import os
+import queue
+import threading
+import time
+import urllib.parse
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 from config import Config
 
 class AdvancedDatabase:
+    # Read-only connection pools for reporting, shared per database file
+    _read_pools = {}
+    _read_pools_lock = threading.Lock()
+    
+    # System log rows waiting to be written in one batch
+    _log_buffer = []
+    _log_dropped = 0
+    _log_lock = threading.Lock()
+    
     def __init__(self, db_name=Config.DATABASE_NAME):
         self.db_name = db_name
         self.init_database()
@@ -19,6 +34,67 @@ class AdvancedDatabase:
             print(f"Database error: {e}")
             return None
     
+    def _get_read_pool(self):
+        """Get the bounded read connection pool for this database"""
+        with self._read_pools_lock:
+            pool = self._read_pools.get(self.db_name)
+            if pool is None:
+                pool = queue.Queue()
+                # Placeholders are replaced by real connections on first use
+                for _ in range(Config.READ_POOL_SIZE):
+                    pool.put(None)
+                self._read_pools[self.db_name] = pool
+            return pool
+    
+    def _open_read_connection(self):
+        """Open a read-only connection that never takes write locks"""
+        path = urllib.parse.quote(os.path.abspath(self.db_name))
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA query_only = 1")
+        return conn
+    
+    @contextmanager
+    def read_snapshot(self):
+        """Borrow a read-only connection holding a consistent WAL snapshot
+        
+        Yields None when all read connections stay busy past the acquire timeout.
+        Queries running longer than READ_QUERY_TIMEOUT are interrupted.
+        """
+        pool = self._get_read_pool()
+        try:
+            conn = pool.get(timeout=Config.READ_ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            print("Report skipped: read connections busy")
+            conn = False
+        
+        if conn is None:
+            try:
+                conn = self._open_read_connection()
+            except sqlite3.Error as e:
+                print(f"Read connection error: {e}")
+                pool.put(None)
+                conn = False
+        
+        if conn is False:
+            yield None
+            return
+        
+        deadline = time.monotonic() + Config.READ_QUERY_TIMEOUT
+        conn.set_progress_handler(lambda: time.monotonic() > deadline, 1000)
+        try:
+            # Holding a read transaction pins the snapshot for every query
+            conn.execute("BEGIN")
+            yield conn
+        finally:
+            try:
+                conn.rollback()
+                conn.set_progress_handler(None, 0)
+                pool.put(conn)
+            except sqlite3.Error:
+                conn.close()
+                pool.put(None)
+    
     def init_database(self):
         """Initialize database with all required tables"""
         conn = self.get_connection()
@@ -28,6 +104,9 @@ class AdvancedDatabase:
         try:
             c = conn.cursor()
             
+            # WAL lets reporting readers work on snapshots without blocking writers
+            c.execute("PRAGMA journal_mode=WAL")
+            
             # Users table
             c.execute('''CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -88,6 +167,29 @@ class AdvancedDatabase:
                 created_at TEXT DEFAULT CURRENT_TIMESTAMP
             )''')
             
+            # Security events table
+            c.execute('''CREATE TABLE IF NOT EXISTS security_events (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                activity TEXT,
+                ip_address TEXT,
+                student_id INTEGER,
+                created_at TEXT
+            )''')
+            c.execute('''CREATE INDEX IF NOT EXISTS idx_security_events_created_at
+                         ON security_events (created_at)''')
+            
+            # Attendance anomaly flags table
+            c.execute('''CREATE TABLE IF NOT EXISTS attendance_flags (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id INTEGER,
+                flag_type TEXT,
+                flag_key TEXT,
+                student_id INTEGER,
+                details TEXT,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+                reviewed BOOLEAN DEFAULT 0
+            )''')
+            
             # Insert default data
             self._create_default_data(c)
             
@@ -228,48 +330,325 @@ class AdvancedDatabase:
         finally:
             conn.close()
     
-    def get_attendance_report(self, class_id):
-        """Generate comprehensive attendance report"""
+    def mark_attendance_batch(self, items, ip_address="", device_info=""):
+        """Mark many queued scans in one transaction, returning a result per item
+        
+        Each item is a dict with session_id, student_id and recorded_at.
+        """
         conn = self.get_connection()
         if not conn:
-            return []
+            return [(False, "Database error") for _ in items]
         
+        results = []
         try:
             cursor = conn.cursor()
+            active_sessions = {}
             
-            cursor.execute('''SELECT u.username, u.full_name, 
-                             COUNT(DISTINCT ar.session_id) as sessions_attended,
-                             COUNT(DISTINCT ass.id) as total_sessions,
-                             (COUNT(DISTINCT ar.session_id) * 100.0 / COUNT(DISTINCT ass.id)) as attendance_rate
-                             FROM users u
-                             CROSS JOIN attendance_sessions ass
-                             LEFT JOIN attendance_records ar ON ar.session_id = ass.id AND ar.student_id = u.id
-                             WHERE u.role = 'student' AND ass.class_id = ?
-                             GROUP BY u.id, u.username, u.full_name''',
-                         (class_id,))
+            for item in items:
+                session_id = item['session_id']
+                
+                cursor.execute('''SELECT 1 FROM attendance_records 
+                                 WHERE session_id = ? AND student_id = ?''',
+                             (session_id, item['student_id']))
+                if cursor.fetchone():
+                    results.append((False, "Already attended this session"))
+                    continue
+                
+                if session_id not in active_sessions:
+                    cursor.execute('''SELECT 1 FROM attendance_sessions 
+                                     WHERE id = ? AND is_active = 1''',
+                                 (session_id,))
+                    active_sessions[session_id] = cursor.fetchone() is not None
+                if not active_sessions[session_id]:
+                    results.append((False, "Session not active or expired"))
+                    continue
+                
+                cursor.execute('''INSERT INTO attendance_records 
+                                (session_id, student_id, recorded_at, ip_address, device_info) 
+                                VALUES (?, ?, ?, ?, ?)''',
+                             (session_id, item['student_id'], item['recorded_at'],
+                              ip_address, device_info))
+                results.append((True, "Attendance marked successfully"))
             
-            report = [dict(row) for row in cursor.fetchall()]
-            return report
+            conn.commit()
             
         except sqlite3.Error as e:
-            print(f"Report generation error: {e}")
-            return []
+            print(f"Batch attendance marking error: {e}")
+            conn.rollback()
+            return [(False, "Database error") for _ in items]
         finally:
             conn.close()
+        
+        marked = sum(1 for success, _ in results if success)
+        if marked:
+            self.log_activity('INFO', f"Batch attendance marked: {marked} of {len(items)} scans",
+                              items[0]['student_id'])
+        
+        return results
+    
+    def get_attendance_report(self, class_id):
+        """Generate comprehensive attendance report (None if the read pool is busy or the query fails)"""
+        with self.read_snapshot() as conn:
+            if not conn:
+                return None
+            
+            try:
+                cursor = conn.cursor()
+                
+                cursor.execute('''SELECT u.username, u.full_name, 
+                                 COUNT(DISTINCT ar.session_id) as sessions_attended,
+                                 COUNT(DISTINCT ass.id) as total_sessions,
+                                 (COUNT(DISTINCT ar.session_id) * 100.0 / COUNT(DISTINCT ass.id)) as attendance_rate
+                                 FROM users u
+                                 CROSS JOIN attendance_sessions ass
+                                 LEFT JOIN attendance_records ar ON ar.session_id = ass.id AND ar.student_id = u.id
+                                 WHERE u.role = 'student' AND ass.class_id = ?
+                                 GROUP BY u.id, u.username, u.full_name''',
+                             (class_id,))
+                
+                report = [dict(row) for row in cursor.fetchall()]
+                return report
+                
+            except sqlite3.Error as e:
+                print(f"Report generation error: {e}")
+                return None
     
     def log_activity(self, level, message, user_id=None):
-        """Log system activities"""
+        """Log system activities (buffered, written by the flush_logs maintenance task)"""
+        with self._log_lock:
+            self._log_buffer.append((level, message, user_id, '127.0.0.1',
+                                     time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())))
+            # Safety valve if the scheduler falls behind: drop the oldest entries
+            overflow = len(self._log_buffer) - Config.LOG_BUFFER_LIMIT
+            if overflow > 0:
+                del self._log_buffer[:overflow]
+                AdvancedDatabase._log_dropped += overflow
+    
+    def flush_logs(self):
+        """Write buffered system logs in one transaction"""
+        with self._log_lock:
+            rows = AdvancedDatabase._log_buffer
+            AdvancedDatabase._log_buffer = []
+            dropped = AdvancedDatabase._log_dropped
+            AdvancedDatabase._log_dropped = 0
+        if dropped:
+            rows.append(('WARNING', f'{dropped} log entries dropped, buffer limit reached', None,
+                         '127.0.0.1', time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())))
+        if not rows:
+            return 0
+        
         conn = self.get_connection()
         if not conn:
-            return
+            return 0
         
         try:
             cursor = conn.cursor()
-            cursor.execute('''INSERT INTO system_logs (level, message, user_id, ip_address) 
-                             VALUES (?, ?, ?, ?)''',
-                         (level, message, user_id, '127.0.0.1'))
+            cursor.executemany('''INSERT INTO system_logs (level, message, user_id, ip_address, created_at) 
+                                 VALUES (?, ?, ?, ?, ?)''', rows)
             conn.commit()
+            return len(rows)
         except sqlite3.Error:
-            pass
+            return 0
+        finally:
+            conn.close()
+    
+    def get_attendance_session_end(self, session_id, max_duration=Config.ATTENDANCE_SESSION_DURATION):
+        """Epoch time an attendance session ended or will auto-close, or None if unknown"""
+        conn = self.get_connection()
+        if not conn:
+            return None
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT session_date, start_time, end_time FROM attendance_sessions 
+                             WHERE id = ?''', (session_id,))
+            row = cursor.fetchone()
+            if not row:
+                return None
+            
+            if row['end_time']:
+                return datetime.fromisoformat(f"{row['session_date']}T{row['end_time']}").timestamp()
+            started = datetime.fromisoformat(f"{row['session_date']}T{row['start_time']}")
+            return (started + timedelta(seconds=max_duration)).timestamp()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            print(f"Session end lookup error: {e}")
+            return None
+        finally:
+            conn.close()
+    
+    def close_expired_attendance_sessions(self, max_duration=Config.ATTENDANCE_SESSION_DURATION):
+        """Deactivate attendance sessions older than max_duration and fill in end_time"""
+        conn = self.get_connection()
+        if not conn:
+            return 0
+        
+        try:
+            cursor = conn.cursor()
+            now = datetime.now()
+            cutoff = now - timedelta(seconds=max_duration)
+            
+            # ISO text compares chronologically, so this only reads candidates
+            cursor.execute('''SELECT id, session_date, start_time FROM attendance_sessions 
+                             WHERE is_active = 1 AND session_date <= ?''',
+                         (cutoff.date().isoformat(),))
+            
+            closed = []
+            for row in cursor.fetchall():
+                try:
+                    started = datetime.fromisoformat(f"{row['session_date']}T{row['start_time']}")
+                except (TypeError, ValueError):
+                    continue
+                if started <= cutoff:
+                    ended = started + timedelta(seconds=max_duration)
+                    closed.append((ended.time().isoformat(), row['id']))
+            
+            if closed:
+                cursor.executemany('''UPDATE attendance_sessions SET is_active = 0, end_time = ? 
+                                     WHERE id = ?''', closed)
+                conn.commit()
+            return len(closed)
+            
+        except sqlite3.Error as e:
+            print(f"Session auto-close error: {e}")
+            return 0
+        finally:
+            conn.close()
+    
+    def get_class_ids(self):
+        """Get the ids of all classes"""
+        with self.read_snapshot() as conn:
+            if not conn:
+                return []
+            
+            try:
+                return [row['id'] for row in conn.execute("SELECT id FROM classes ORDER BY id")]
+            except sqlite3.Error as e:
+                print(f"Class lookup error: {e}")
+                return []
+    
+    def save_security_events(self, events):
+        """Persist a batch of security events in one transaction"""
+        if not events:
+            return True
+        
+        conn = self.get_connection()
+        if not conn:
+            return False
+        
+        try:
+            cursor = conn.cursor()
+            cursor.executemany('''INSERT INTO security_events 
+                                 (activity, ip_address, student_id, created_at) 
+                                 VALUES (?, ?, ?, ?)''',
+                             [(e['activity'], e['ip'], e.get('student_id'), e['timestamp'])
+                              for e in events])
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Security event save error: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def prune_security_events(self, max_age_days=Config.SECURITY_EVENT_RETENTION_DAYS):
+        """Delete persisted security events older than max_age_days"""
+        conn = self.get_connection()
+        if not conn:
+            return 0
+        
+        try:
+            # created_at is an ISO timestamp, so string order is time order
+            cutoff = (datetime.now() - timedelta(days=max_age_days)).isoformat()
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM security_events WHERE created_at < ?", (cutoff,))
+            conn.commit()
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            print(f"Security event prune error: {e}")
+            return 0
+        finally:
+            conn.close()
+    
+    def load_security_events(self, limit=100):
+        """Load the most recent security events, oldest first"""
+        conn = self.get_connection()
+        if not conn:
+            return []
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''SELECT activity, ip_address, student_id, created_at 
+                             FROM security_events ORDER BY id DESC LIMIT ?''',
+                         (limit,))
+            rows = cursor.fetchall()
+            return [{
+                'timestamp': row['created_at'],
+                'activity': row['activity'],
+                'ip': row['ip_address'],
+                'student_id': row['student_id']
+            } for row in reversed(rows)]
+        except sqlite3.Error as e:
+            print(f"Security event load error: {e}")
+            return []
+        finally:
+            conn.close()
+    
+    def save_attendance_flag(self, flag):
+        """Store an attendance anomaly flag for teacher review"""
+        conn = self.get_connection()
+        if not conn:
+            return False
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''INSERT INTO attendance_flags 
+                            (session_id, flag_type, flag_key, student_id, details) 
+                            VALUES (?, ?, ?, ?, ?)''',
+                         (flag['session_id'], flag['type'], flag['key'],
+                          flag.get('student_id'), json.dumps(flag.get('details', {}))))
+            conn.commit()
+            return True
+        except sqlite3.Error as e:
+            print(f"Attendance flag save error: {e}")
+            return False
+        finally:
+            conn.close()
+    
+    def get_attendance_flags(self, limit=50, include_reviewed=False):
+        """Get the most recent attendance anomaly flags (None if the read pool is busy or the query fails)"""
+        with self.read_snapshot() as conn:
+            if not conn:
+                return None
+            
+            try:
+                cursor = conn.cursor()
+                cursor.execute('''SELECT * FROM attendance_flags 
+                                 WHERE reviewed = 0 OR ? 
+                                 ORDER BY id DESC LIMIT ?''',
+                             (1 if include_reviewed else 0, limit))
+                flags = []
+                for row in cursor.fetchall():
+                    flag = dict(row)
+                    flag['details'] = json.loads(flag['details'] or '{}')
+                    flags.append(flag)
+                return flags
+            except sqlite3.Error as e:
+                print(f"Attendance flag load error: {e}")
+                return None
+    
+    def mark_flag_reviewed(self, flag_id):
+        """Mark an attendance anomaly flag as reviewed"""
+        conn = self.get_connection()
+        if not conn:
+            return False
+        
+        try:
+            cursor = conn.cursor()
+            cursor.execute("UPDATE attendance_flags SET reviewed = 1 WHERE id = ?", (flag_id,))
+            conn.commit()
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Attendance flag review error: {e}")
+            return False
         finally:
             conn.close()
@@ -1,5 +1,10 @@
 import random
 import string
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from config import Config
 
 def generate_secret_code(length=16):
     """Generate a random secret code for QR"""
@@ -8,8 +13,8 @@ def generate_secret_code(length=16):
 
 def generate_simple_qr(data):
     """Create a simple text-based QR representation"""
-    # For demo purposes, we'll just return the data
-    # In a real system, you'd generate an actual QR image
+    # Kept for callers that only need the text payload;
+    # use render_qr_svg / render_qr_png for a real QR image
     return f"QR_CODE:{data}"
 
 def parse_qr_data(qr_data):
@@ -17,3 +22,366 @@ def parse_qr_data(qr_data):
     if qr_data.startswith("QR_CODE:"):
         return qr_data[8:]  # Remove "QR_CODE:" prefix
     return None
+
+# QR encoder (byte mode, versions 1-10) following ISO/IEC 18004
+QR_MAX_VERSION = 10
+
+# Format bits and per-version block layout for error correction levels L, M, Q, H
+_ECC_FORMAT_BITS = {'L': 1, 'M': 0, 'Q': 3, 'H': 2}
+_ECC_CODEWORDS_PER_BLOCK = {
+    'L': [None, 7, 10, 15, 20, 26, 18, 20, 24, 30, 18],
+    'M': [None, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26],
+    'Q': [None, 13, 22, 18, 26, 18, 24, 18, 22, 20, 24],
+    'H': [None, 17, 28, 22, 16, 22, 28, 26, 26, 24, 28],
+}
+_ECC_BLOCKS = {
+    'L': [None, 1, 1, 1, 1, 1, 2, 2, 2, 2, 4],
+    'M': [None, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5],
+    'Q': [None, 1, 1, 2, 2, 4, 4, 6, 6, 8, 8],
+    'H': [None, 1, 1, 2, 4, 4, 4, 5, 6, 8, 8],
+}
+
+def _raw_data_modules(version):
+    """Number of data modules available after function patterns"""
+    result = (16 * version + 128) * version + 64
+    if version >= 2:
+        num_align = version // 7 + 2
+        result -= (25 * num_align - 10) * num_align - 55
+        if version >= 7:
+            result -= 36
+    return result
+
+def _data_codewords(version, ecc):
+    return _raw_data_modules(version) // 8 - _ECC_CODEWORDS_PER_BLOCK[ecc][version] * _ECC_BLOCKS[ecc][version]
+
+def _alignment_positions(version, size):
+    if version == 1:
+        return []
+    num_align = version // 7 + 2
+    step = (version * 8 + num_align * 3 + 5) // (num_align * 4 - 4) * 2
+    return [6] + sorted(size - 7 - i * step for i in range(num_align - 1))
+
+def _gf_multiply(x, y):
+    """Multiply in GF(2^8) modulo x^8 + x^4 + x^3 + x^2 + 1"""
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+def _rs_divisor(degree):
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_multiply(root, 0x02)
+    return result
+
+def _rs_remainder(data, divisor):
+    result = [0] * len(divisor)
+    for byte in data:
+        factor = byte ^ result.pop(0)
+        result.append(0)
+        for i, coefficient in enumerate(divisor):
+            result[i] ^= _gf_multiply(coefficient, factor)
+    return result
+
+def _encode_codewords(payload, version, ecc):
+    """Byte-mode segment, padding, error correction and interleaving"""
+    bits = []
+    
+    def append_bits(value, length):
+        bits.extend((value >> i) & 1 for i in reversed(range(length)))
+    
+    append_bits(0b0100, 4)
+    append_bits(len(payload), 8 if version < 10 else 16)
+    for byte in payload:
+        append_bits(byte, 8)
+    
+    capacity = _data_codewords(version, ecc) * 8
+    append_bits(0, min(4, capacity - len(bits)))
+    append_bits(0, -len(bits) % 8)
+    data = [int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(data) * 8 < capacity:
+        data.append(pad)
+        pad ^= 0xEC ^ 0x11
+    
+    num_blocks = _ECC_BLOCKS[ecc][version]
+    block_ecc_len = _ECC_CODEWORDS_PER_BLOCK[ecc][version]
+    raw_codewords = _raw_data_modules(version) // 8
+    num_short_blocks = num_blocks - raw_codewords % num_blocks
+    short_block_len = raw_codewords // num_blocks
+    divisor = _rs_divisor(block_ecc_len)
+    
+    blocks = []
+    k = 0
+    for i in range(num_blocks):
+        block = data[k:k + short_block_len - block_ecc_len + (0 if i < num_short_blocks else 1)]
+        k += len(block)
+        ecc_bytes = _rs_remainder(block, divisor)
+        if i < num_short_blocks:
+            block.append(0)
+        blocks.append(block + ecc_bytes)
+    
+    result = []
+    for i in range(len(blocks[0])):
+        for j, block in enumerate(blocks):
+            # Skip the padding byte of short blocks
+            if i != short_block_len - block_ecc_len or j >= num_short_blocks:
+                result.append(block[i])
+    return result
+
+_MASKS = [
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+]
+
+class _QRMatrix:
+    """Module grid under construction"""
+    
+    def __init__(self, version):
+        self.version = version
+        self.size = version * 4 + 17
+        self.modules = [[False] * self.size for _ in range(self.size)]
+        self.is_function = [[False] * self.size for _ in range(self.size)]
+    
+    def set_function(self, x, y, dark):
+        self.modules[y][x] = dark
+        self.is_function[y][x] = True
+    
+    def draw_function_patterns(self):
+        size = self.size
+        for i in range(size):
+            self.set_function(6, i, i % 2 == 0)
+            self.set_function(i, 6, i % 2 == 0)
+        
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self.set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+        
+        positions = _alignment_positions(self.version, size)
+        last = len(positions) - 1
+        for i, cx in enumerate(positions):
+            for j, cy in enumerate(positions):
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set_function(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+        
+        self.draw_format_bits('M', 0)  # Reserve area, real bits drawn after masking
+        self.draw_version_bits()
+    
+    def draw_format_bits(self, ecc, mask):
+        data = _ECC_FORMAT_BITS[ecc] << 3 | mask
+        rem = data
+        for _ in range(10):
+            rem = (rem << 1) ^ ((rem >> 9) * 0x537)
+        bits = (data << 10 | rem) ^ 0x5412
+        bit = lambda i: (bits >> i) & 1 != 0
+        size = self.size
+        
+        for i in range(6):
+            self.set_function(8, i, bit(i))
+        self.set_function(8, 7, bit(6))
+        self.set_function(8, 8, bit(7))
+        self.set_function(7, 8, bit(8))
+        for i in range(9, 15):
+            self.set_function(14 - i, 8, bit(i))
+        
+        for i in range(8):
+            self.set_function(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self.set_function(8, size - 15 + i, bit(i))
+        self.set_function(8, size - 8, True)
+    
+    def draw_version_bits(self):
+        if self.version < 7:
+            return
+        rem = self.version
+        for _ in range(12):
+            rem = (rem << 1) ^ ((rem >> 11) * 0x1F25)
+        bits = self.version << 12 | rem
+        for i in range(18):
+            dark = (bits >> i) & 1 != 0
+            a, b = self.size - 11 + i % 3, i // 3
+            self.set_function(a, b, dark)
+            self.set_function(b, a, dark)
+    
+    def draw_codewords(self, codewords):
+        size = self.size
+        i = 0
+        total_bits = len(codewords) * 8
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vert in range(size):
+                y = size - 1 - vert if upward else vert
+                for x in (right, right - 1):
+                    if not self.is_function[y][x] and i < total_bits:
+                        self.modules[y][x] = (codewords[i >> 3] >> (7 - (i & 7))) & 1 != 0
+                        i += 1
+            right -= 2
+    
+    def apply_mask(self, mask):
+        condition = _MASKS[mask]
+        for y in range(self.size):
+            row, function_row = self.modules[y], self.is_function[y]
+            for x in range(self.size):
+                if not function_row[x] and condition(x, y):
+                    row[x] = not row[x]
+    
+    def penalty(self):
+        """Simplified penalty score (runs, 2x2 blocks and dark balance)"""
+        size, modules = self.size, self.modules
+        score = 0
+        for lines in (modules, list(zip(*modules))):
+            for line in lines:
+                run = 1
+                for a, b in zip(line, line[1:]):
+                    if a == b:
+                        run += 1
+                    else:
+                        if run >= 5:
+                            score += run - 2
+                        run = 1
+                if run >= 5:
+                    score += run - 2
+        for y in range(size - 1):
+            for x in range(size - 1):
+                if modules[y][x] == modules[y][x + 1] == modules[y + 1][x] == modules[y + 1][x + 1]:
+                    score += 3
+        dark = sum(sum(row) for row in modules)
+        total = size * size
+        score += (abs(dark * 20 - total * 10) + total - 1) // total * 10 - 10
+        return score
+
+def encode_qr(data, ecc='M', mask=None):
+    """Encode text as a QR code and return its module matrix (True = dark)
+    
+    The mask with the lowest penalty is chosen unless one is given.
+    """
+    payload = data.encode('utf-8')
+    for version in range(1, QR_MAX_VERSION + 1):
+        count_bits = 8 if version < 10 else 16
+        if 4 + count_bits + len(payload) * 8 <= _data_codewords(version, ecc) * 8:
+            break
+    else:
+        raise ValueError(f"Data too long for a version {QR_MAX_VERSION} QR code")
+    
+    matrix = _QRMatrix(version)
+    matrix.draw_function_patterns()
+    matrix.draw_codewords(_encode_codewords(payload, version, ecc))
+    
+    if mask is None:
+        best_score = None
+        for candidate in range(8):
+            matrix.apply_mask(candidate)
+            matrix.draw_format_bits(ecc, candidate)
+            score = matrix.penalty()
+            if best_score is None or score < best_score:
+                mask, best_score = candidate, score
+            matrix.apply_mask(candidate)  # XOR again to undo
+    
+    matrix.apply_mask(mask)
+    matrix.draw_format_bits(ecc, mask)
+    return matrix.modules
+
+def render_qr_svg(modules, scale=8, border=4):
+    """Render a module matrix as an SVG document"""
+    size = len(modules) + border * 2
+    path = ''.join(f"M{x + border},{y + border}h1v1h-1z"
+                   for y, row in enumerate(modules) for x, dark in enumerate(row) if dark)
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" version="1.1" '
+            f'width="{size * scale}" height="{size * scale}" viewBox="0 0 {size} {size}" '
+            f'shape-rendering="crispEdges">'
+            f'<rect width="100%" height="100%" fill="#ffffff"/>'
+            f'<path d="{path}" fill="#000000"/></svg>')
+
+def render_qr_png(modules, scale=8, border=4):
+    """Render a module matrix as a grayscale PNG"""
+    size = (len(modules) + border * 2) * scale
+    blank = b'\xff' * size
+    rows = [b'\x00' + blank] * (border * scale)
+    for row in modules:
+        line = b'\xff' * (border * scale) + b''.join(
+            (b'\x00' if dark else b'\xff') * scale for dark in row) + b'\xff' * (border * scale)
+        rows.extend([b'\x00' + line] * scale)
+    rows.extend([b'\x00' + blank] * (border * scale))
+    
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body) & 0xFFFFFFFF)
+    
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 0, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(b''.join(rows), 9)) +
+            chunk(b'IEND', b''))
+
+class QRImageCache:
+    """LRU cache of rendered QR images keyed by QR data and format"""
+    
+    RENDERERS = {'svg': render_qr_svg, 'png': render_qr_png}
+    
+    def __init__(self, capacity=Config.QR_IMAGE_CACHE_SIZE):
+        self.capacity = capacity
+        self._images = OrderedDict()
+        self._rendering = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, data, fmt='svg'):
+        """Return rendered image bytes, encoding the matrix only on a miss"""
+        key = (data, fmt)
+        with self._lock:
+            image = self._images.get(key)
+            if image is not None:
+                self._images.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+        
+        rendered = self.RENDERERS[fmt](encode_qr(data))
+        image = rendered.encode() if isinstance(rendered, str) else rendered
+        with self._lock:
+            self._images[key] = image
+            while len(self._images) > self.capacity:
+                self._images.popitem(last=False)
+        return image
+    
+    def prerender(self, data_items, formats=('svg',)):
+        """Render upcoming codes in the background so polls hit the cache"""
+        with self._lock:
+            # Only start work for images that are neither cached nor already being rendered
+            keys = [(data, fmt) for data in data_items for fmt in formats
+                    if (data, fmt) not in self._images and (data, fmt) not in self._rendering]
+            if not keys:
+                return None
+            self._rendering.update(keys)
+        
+        def work():
+            for data, fmt in keys:
+                try:
+                    self.get(data, fmt)
+                finally:
+                    with self._lock:
+                        self._rendering.discard((data, fmt))
+        
+        thread = threading.Thread(target=work, daemon=True)
+        thread.start()
+        return thread
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Advanced Attendance System - Trace Replay
+Drives a recorded request trace against a local server and compares latency runs.
+
+    python replay.py run request_trace_1700000000.jsonl.gz --speed 2 --output build_a.json
+    python replay.py compare build_a.json build_b.json
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import ThreadingHTTPServer
+from tracing import load_trace
+
+# The handler records scans against the QR code's class id used as the session id
+REPLAY_SESSION_ID = 1
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def summarize(results):
+    """Latency distribution and error counts per route"""
+    by_route = {}
+    for result in results:
+        by_route.setdefault(f"{result['m']} {result['r']}", []).append(result)
+    
+    summary = {}
+    for route, items in sorted(by_route.items()):
+        latencies = sorted(item['latency'] for item in items)
+        summary[route] = {
+            'count': len(items),
+            # An HTTP 200 carrying success: false took a rejection path, not the real one
+            'errors': sum(1 for item in items if not item['s'] or item['s'] >= 500 and item['s'] != 503
+                          or item.get('ok') is False),
+            'shed': sum(1 for item in items if item['s'] == 503),
+            'p50': round(percentile(latencies, 50), 3),
+            'p90': round(percentile(latencies, 90), 3),
+            'p99': round(percentile(latencies, 99), 3),
+            'max': round(latencies[-1], 3)
+        }
+    return summary
+
+class LocalReplayTarget:
+    """In-process server on a private copy of the database"""
+    
+    def __init__(self, db_path=None, port=0):
+        self.workdir = tempfile.mkdtemp(prefix="attendance_replay_")
+        self.original_cwd = os.getcwd()
+        if db_path:
+            self.copy_database(os.path.abspath(db_path), os.path.join(self.workdir, "attendance_system.db"))
+        # The database name is relative, so the copy is picked up from the work directory
+        os.chdir(self.workdir)
+        
+        import server
+        from database import AdvancedDatabase
+        self.handler = server.AdvancedAttendanceHandler
+        self.db = AdvancedDatabase()
+        self.open_replay_session()
+        # The replay session was just reopened, so skip the startup auto-close
+        self.scheduler = server.create_scheduler(self.db, close_sessions_now=False)
+        self.scheduler.start()
+        self.httpd = ThreadingHTTPServer(("localhost", port), self.handler)
+        self.base_url = f"http://localhost:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        
+        self.sessions = {}
+        self._lock = threading.Lock()
+    
+    def open_replay_session(self, session_id=REPLAY_SESSION_ID):
+        """Make the session that scans are written to active, starting now"""
+        now = datetime.now()
+        values = (now.date().isoformat(), now.time().isoformat(), session_id)
+        conn = self.db.get_connection()
+        try:
+            cursor = conn.execute('''UPDATE attendance_sessions 
+                                     SET session_date = ?, start_time = ?, end_time = NULL, is_active = 1 
+                                     WHERE id = ?''', values)
+            if not cursor.rowcount:
+                conn.execute('''INSERT INTO attendance_sessions 
+                                (session_date, start_time, id, class_id, secret_token, is_active) 
+                                VALUES (?, ?, ?, ?, 'replay', 1)''', values + (session_id,))
+            conn.commit()
+        finally:
+            conn.close()
+    
+    def copy_database(self, source_path, target_path):
+        """Consistent copy including pages still in the source's WAL"""
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+    
+    def session_for(self, actor, role):
+        """Auth session for a trace pseudonym, creating its user on first use"""
+        if not actor or not role:
+            return None
+        with self._lock:
+            if actor not in self.sessions:
+                username = f"replay_{actor}"
+                conn = self.db.get_connection()
+                try:
+                    row = conn.execute("SELECT id FROM users WHERE username = ?", (username,)).fetchone()
+                    if row:
+                        user_id = row['id']
+                    else:
+                        cursor = conn.execute('''INSERT INTO users (username, password_hash, role, full_name)
+                                                 VALUES (?, ?, ?, ?)''', (username, '', role, username))
+                        conn.commit()
+                        user_id = cursor.lastrowid
+                finally:
+                    conn.close()
+                self.sessions[actor] = self.handler.shared_auth.create_session(user_id, username, role)
+            return self.sessions[actor]
+    
+    def current_qr_data(self):
+        return self.handler.shared_security.generate_secure_qr_data(1)
+    
+    def build_value(self, key, shape):
+        """Synthesize a value matching a recorded shape"""
+        if key == 'qr_data':
+            return self.current_qr_data()
+        if key == 'scanned_at':
+            return time.time()
+        if isinstance(shape, dict) and 'list' in shape:
+            return [self.build_value(f'{key}_item', shape['item']) for _ in range(shape['list'])]
+        if isinstance(shape, dict):
+            return {name: self.build_value(name, item) for name, item in shape.items()}
+        if isinstance(shape, str) and shape.startswith('str:'):
+            return 'x' * int(shape[4:])
+        if shape == 'num':
+            return 1
+        if shape == 'bool':
+            return True
+        return None
+    
+    def close(self):
+        self.httpd.shutdown()
+        self.scheduler.stop()
+        os.chdir(self.original_cwd)
+        shutil.rmtree(self.workdir, ignore_errors=True)
+
+def send_request(target, record):
+    """Replay one trace record and measure client-side latency"""
+    path = record['r'].replace('<id>', '1')
+    if record.get('q'):
+        path += '?' + '&'.join(f"{key}={value}" for key, value in record['q'].items())
+    
+    headers = {'User-Agent': 'attendance-replay'}
+    session_id = target.session_for(record.get('a'), record.get('role'))
+    if session_id:
+        headers['Cookie'] = f'session_id={session_id}'
+    
+    data = None
+    if record['m'] == 'POST':
+        # A recorded empty body is replayed empty rather than as a cheaper {}
+        data = json.dumps(target.build_value('body', record['b'])).encode() if record.get('b') else b''
+        headers['Content-Type'] = 'application/json'
+    
+    request = urllib.request.Request(target.base_url + path, data=data, headers=headers, method=record['m'])
+    started = time.perf_counter()
+    body = b''
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except (urllib.error.URLError, OSError):
+        status = None
+    latency = (time.perf_counter() - started) * 1000
+    return {'m': record['m'], 'r': record['r'], 's': status,
+            'ok': app_success(body), 'latency': latency}
+
+def app_success(body):
+    """The JSON 'success' field of a response, or None for non-JSON responses"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    return data.get('success') if isinstance(data, dict) else None
+
+def replay(trace, target, speed=1.0, workers=64):
+    """Replay records at their original offsets divided by speed"""
+    trace = sorted(trace, key=lambda record: record['t'])
+    futures = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for record in trace:
+            delay = record['t'] / speed - (time.perf_counter() - started)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(pool.submit(send_request, target, record))
+    return [future.result() for future in futures], time.perf_counter() - started
+
+def compare(baseline, candidate):
+    """Print per-route latency changes between two replay runs"""
+    print(f"{'route':<40} {'p50 A':>9} {'p50 B':>9} {'p99 A':>9} {'p99 B':>9} {'p99 Δ':>8} {'shed A/B':>10}")
+    for route in sorted(set(baseline['summary']) | set(candidate['summary'])):
+        a = baseline['summary'].get(route)
+        b = candidate['summary'].get(route)
+        if not a or not b:
+            print(f"{route:<40} only in {'baseline' if a else 'candidate'}")
+            continue
+        delta = (b['p99'] - a['p99']) * 100.0 / a['p99'] if a['p99'] else 0.0
+        print(f"{route:<40} {a['p50']:>9.2f} {b['p50']:>9.2f} {a['p99']:>9.2f} {b['p99']:>9.2f} "
+              f"{delta:>+7.1f}% {a['shed']:>4}/{b['shed']:<4}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded attendance request traces")
+    commands = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = commands.add_parser('run', help="replay a trace against a local server")
+    run_parser.add_argument('trace', help="trace file written by the recorder")
+    run_parser.add_argument('--db', help="database to copy for the run (default: fresh database)")
+    run_parser.add_argument('--port', type=int, default=0, help="local port (default: any free port)")
+    run_parser.add_argument('--speed', type=float, default=1.0, help="replay speed multiplier")
+    run_parser.add_argument('--workers', type=int, default=64, help="maximum concurrent requests")
+    run_parser.add_argument('--output', help="write results JSON here")
+    
+    compare_parser = commands.add_parser('compare', help="compare two replay result files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    
+    args = parser.parse_args()
+    
+    if args.command == 'compare':
+        with open(args.baseline) as a, open(args.candidate) as b:
+            compare(json.load(a), json.load(b))
+        return
+    
+    trace_path = os.path.abspath(args.trace)
+    output_path = os.path.abspath(args.output) if args.output else None
+    db_path = os.path.abspath(args.db) if args.db else None
+    
+    trace = load_trace(trace_path)
+    target = LocalReplayTarget(db_path, args.port)
+    try:
+        print(f"🎞️ Replaying {len(trace)} requests at {args.speed}x against {target.base_url}")
+        results, wall_time = replay(trace, target, args.speed, args.workers)
+    finally:
+        target.close()
+    
+    report = {
+        'trace': trace_path,
+        'speed': args.speed,
+        'requests': len(results),
+        'wall_time': round(wall_time, 3),
+        'summary': summarize(results),
+        'results': results
+    }
+    for route, stats in report['summary'].items():
+        print(f"{route:<40} n={stats['count']:<5} p50={stats['p50']:.2f}ms p99={stats['p99']:.2f}ms "
+              f"shed={stats['shed']} errors={stats['errors']}")
+    
+    if output_path:
+        with open(output_path, 'w') as output_file:
+            json.dump(report, output_file)
+        print(f"📝 Results written to {output_path}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+import heapq
+import itertools
+import random
+import threading
+import time
+from config import Config
+
+class MaintenanceTask:
+    """A periodic job and its run statistics"""
+    
+    def __init__(self, name, func, interval, jitter):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.jitter = jitter
+        self.runs = 0
+        self.failures = 0
+        self.last_run = None
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+        self.total_duration = 0.0
+        self.last_error = None
+        self.next_run = None
+    
+    def next_delay(self):
+        """Interval with random jitter so tasks do not fire in lockstep"""
+        spread = self.interval * self.jitter
+        return max(0.1, self.interval + random.uniform(-spread, spread))
+    
+    def stats(self):
+        return {
+            'interval': self.interval,
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_run': self.last_run,
+            'last_duration': round(self.last_duration, 4),
+            'max_duration': round(self.max_duration, 4),
+            'avg_duration': round(self.total_duration / self.runs, 4) if self.runs else 0.0,
+            'last_error': self.last_error,
+            'next_run': self.next_run
+        }
+
+class MaintenanceScheduler:
+    """Runs maintenance tasks off the request path from a single heap-ordered thread"""
+    
+    def __init__(self, jitter=Config.MAINTENANCE_JITTER):
+        self.jitter = jitter
+        self.tasks = {}
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._running = False
+    
+    def add_task(self, name, func, interval, run_now=False):
+        """Register a periodic task"""
+        task = MaintenanceTask(name, func, interval, self.jitter)
+        with self._condition:
+            self.tasks[name] = task
+            # Spread first runs so tasks with equal intervals do not collide
+            delay = 0 if run_now else random.uniform(0, task.next_delay())
+            self._schedule(task, time.time() + delay)
+        return task
+    
+    def _schedule(self, task, when):
+        task.next_run = when
+        heapq.heappush(self._heap, (when, next(self._counter), task))
+        self._condition.notify()
+    
+    def start(self):
+        """Start the scheduler thread"""
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+        self._thread.start()
+    
+    def stop(self, timeout=5):
+        """Stop the scheduler thread"""
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join(timeout)
+    
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and (not self._heap or self._heap[0][0] > time.time()):
+                    timeout = self._heap[0][0] - time.time() if self._heap else None
+                    self._condition.wait(timeout)
+                if not self._running:
+                    return
+                _, _, task = heapq.heappop(self._heap)
+            
+            self.run_task(task)
+            
+            with self._condition:
+                if self.tasks.get(task.name) is task:
+                    self._schedule(task, time.time() + task.next_delay())
+    
+    def run_task(self, task):
+        """Run one task, recording timing and failures"""
+        started = time.time()
+        try:
+            task.func()
+            task.last_error = None
+        except Exception as e:
+            task.failures += 1
+            task.last_error = str(e)
+            print(f"Maintenance task {task.name} failed: {e}")
+        finally:
+            duration = time.time() - started
+            task.runs += 1
+            task.last_run = started
+            task.last_duration = duration
+            task.total_duration += duration
+            task.max_duration = max(task.max_duration, duration)
+    
+    def get_stats(self):
+        """Run statistics for every task"""
+        with self._condition:
+            return {name: task.stats() for name, task in self.tasks.items()}
@@ -1,17 +1,120 @@
 import hashlib
+import hmac
+import threading
 import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
 from config import Config
 
+class SecurityEventBuffer:
+    """Fixed-capacity ring buffer holding the most recent security events"""
+    
+    def __init__(self, capacity=Config.SECURITY_EVENT_CAPACITY):
+        self.capacity = capacity
+        self._events = [None] * capacity
+        self._next = 0
+        self._size = 0
+        self.total = 0
+    
+    def append(self, event):
+        """Store event, overwriting the oldest one when full"""
+        self._events[self._next] = event
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+        self.total += 1
+    
+    def recent(self, count=None):
+        """Return up to count most recent events, oldest first"""
+        count = self._size if count is None else min(count, self._size)
+        start = self._next - count
+        return [self._events[i % self.capacity] for i in range(start, self._next)]
+    
+    def __len__(self):
+        return self._size
+
+class SlidingWindowCounter:
+    """Bucketed per-key event counts over a sliding time window"""
+    
+    def __init__(self, window=Config.SECURITY_WINDOW_SECONDS,
+                 buckets=Config.SECURITY_WINDOW_BUCKETS,
+                 max_keys=Config.SECURITY_MAX_TRACKED_KEYS):
+        self.window = window
+        self.bucket_width = max(1, window / buckets)
+        self.max_keys = max_keys
+        # key -> [deque of [bucket_start, count], running total]
+        self._counters = OrderedDict()
+    
+    def _expire(self, entry, now):
+        buckets = entry[0]
+        while buckets and buckets[0][0] <= now - self.window:
+            entry[1] -= buckets.popleft()[1]
+    
+    def add(self, key, now=None):
+        """Count one event for key"""
+        now = time.time() if now is None else now
+        entry = self._counters.get(key)
+        if entry is None:
+            entry = self._counters[key] = [deque(), 0]
+            # Evict least recently active key to bound memory
+            if len(self._counters) > self.max_keys:
+                self._counters.popitem(last=False)
+        else:
+            self._counters.move_to_end(key)
+        
+        self._expire(entry, now)
+        bucket_start = now - (now % self.bucket_width)
+        buckets = entry[0]
+        if buckets and buckets[-1][0] == bucket_start:
+            buckets[-1][1] += 1
+        else:
+            buckets.append([bucket_start, 1])
+        entry[1] += 1
+    
+    def count(self, key, now=None):
+        """Events seen for key within the window"""
+        entry = self._counters.get(key)
+        if entry is None:
+            return 0
+        self._expire(entry, time.time() if now is None else now)
+        return entry[1]
+    
+    def top(self, limit=5, now=None):
+        """Keys with the most events in the window"""
+        now = time.time() if now is None else now
+        totals = []
+        for key, entry in self._counters.items():
+            self._expire(entry, now)
+            if entry[1]:
+                totals.append((key, entry[1]))
+        totals.sort(key=lambda item: item[1], reverse=True)
+        return totals[:limit]
+
 class AdvancedSecurity:
-    def __init__(self):
+    def __init__(self, db=None):
         self.active_qr_sessions = {}
-        self.suspicious_activities = []
+        self.suspicious_activities = SecurityEventBuffer()
+        self.ip_counters = SlidingWindowCounter()
+        self.student_counters = SlidingWindowCounter()
+        self.db = db if Config.SECURITY_PERSIST_EVENTS else None
+        self._pending_events = []
+        self.dropped_events = 0
+        self._lock = threading.Lock()
+        self._restore_events()
+    
+    def current_qr_slot(self, offset=0):
+        """Start of the current QR rotation slot, shifted by offset slots"""
+        now = int(time.time())
+        return now - now % Config.QR_ROTATION_INTERVAL + offset * Config.QR_ROTATION_INTERVAL
+    
+    def qr_data_for_slot(self, class_id, timestamp):
+        """QR data for a rotation slot without registering a session"""
+        return f"ATTEND:{class_id}:{self._sign_token(class_id, timestamp)}:{timestamp}"
     
     def generate_secure_qr_data(self, class_id):
         """Generate secure QR code data with timestamp"""
-        timestamp = int(time.time())
-        random_token = hashlib.sha256(f"{class_id}{timestamp}{Config.SECRET_KEY}".encode()).hexdigest()[:16]
+        # Aligning to rotation slots keeps the code stable between polls
+        timestamp = self.current_qr_slot()
+        random_token = self._sign_token(class_id, timestamp)
         
         qr_data = {
             'class_id': class_id,
@@ -24,69 +127,168 @@ class AdvancedSecurity:
         session_key = f"{class_id}_{random_token}"
         self.active_qr_sessions[session_key] = qr_data
         
-        return f"ATTEND:{class_id}:{random_token}:{timestamp}"
+        return self.qr_data_for_slot(class_id, timestamp)
     
-    def validate_qr_data(self, qr_data, student_ip=""):
+    def validate_qr_data(self, qr_data, student_ip="", student_id=None):
         """Validate QR code data with security checks"""
         try:
             if not qr_data.startswith("ATTEND:"):
+                self.record_suspicious_activity("Invalid QR format submitted", student_ip, student_id)
                 return None, "Invalid QR format"
             
             parts = qr_data.split(':')
             if len(parts) != 4:
+                self.record_suspicious_activity("Malformed QR data submitted", student_ip, student_id)
                 return None, "Malformed QR data"
             
             class_id, token, timestamp = int(parts[1]), parts[2], int(parts[3])
             session_key = f"{class_id}_{token}"
             
-            # Check if session exists
-            if session_key not in self.active_qr_sessions:
+            # Check if session exists (single lookup, since other threads may remove it)
+            session = self.active_qr_sessions.get(session_key)
+            if session is None:
+                self.record_suspicious_activity(f"Unknown QR token submitted for class {class_id}",
+                                                student_ip, student_id)
                 return None, "Invalid or expired QR session"
             
-            session = self.active_qr_sessions[session_key]
-            
             # Check expiration
             if time.time() > session['expires_at']:
-                del self.active_qr_sessions[session_key]
+                self.active_qr_sessions.pop(session_key, None)
                 return None, "QR code has expired"
             
             # Check timestamp validity
             if abs(time.time() - timestamp) > Config.QR_CODE_TIMEOUT:
-                self.record_suspicious_activity(f"Timestamp manipulation detected from IP: {student_ip}")
+                self.record_suspicious_activity(f"Timestamp manipulation detected from IP: {student_ip}",
+                                                student_ip, student_id)
                 return None, "Invalid timestamp"
             
             return session, "Valid"
             
         except Exception as e:
-            self.record_suspicious_activity(f"QR validation error: {str(e)}")
+            self.record_suspicious_activity(f"QR validation error: {str(e)}", student_ip, student_id)
             return None, "Validation error"
     
-    def record_suspicious_activity(self, activity):
+    def _sign_token(self, class_id, timestamp):
+        """Derive the QR token for a class and issue time"""
+        return hashlib.sha256(f"{class_id}{timestamp}{Config.SECRET_KEY}".encode()).hexdigest()[:16]
+    
+    def validate_offline_scan(self, qr_data, scanned_at, student_ip="", student_id=None):
+        """Validate a queued scan against the token window valid when it was scanned"""
+        try:
+            parts = qr_data.split(':')
+            if len(parts) != 4 or parts[0] != "ATTEND":
+                self.record_suspicious_activity("Malformed queued QR data submitted", student_ip, student_id)
+                return None, "Malformed QR data"
+            
+            class_id, token, timestamp = int(parts[1]), parts[2], int(parts[3])
+            scanned_at = float(scanned_at)
+            
+            # Tokens are signed, so expired windows can still be verified
+            if not hmac.compare_digest(token, self._sign_token(class_id, timestamp)):
+                self.record_suspicious_activity(f"Forged queued QR token for class {class_id}",
+                                                student_ip, student_id)
+                return None, "Invalid QR token"
+            
+            now = time.time()
+            if scanned_at > now + Config.SCAN_CLOCK_SKEW:
+                self.record_suspicious_activity(f"Future scan timestamp from IP: {student_ip}",
+                                                student_ip, student_id)
+                return None, "Invalid scan timestamp"
+            
+            if now - scanned_at > Config.OFFLINE_SCAN_MAX_AGE:
+                return None, "Queued scan is too old"
+            
+            expires_at = timestamp + Config.QR_CODE_TIMEOUT
+            if not (timestamp - Config.SCAN_CLOCK_SKEW <= scanned_at <= expires_at + Config.SCAN_CLOCK_SKEW):
+                return None, "QR code was not valid at scan time"
+            
+            return {
+                'class_id': class_id,
+                'token': token,
+                'created_at': timestamp,
+                'expires_at': expires_at
+            }, "Valid"
+            
+        except (ValueError, TypeError, AttributeError) as e:
+            self.record_suspicious_activity(f"Queued QR validation error: {str(e)}", student_ip, student_id)
+            return None, "Validation error"
+    
+    def record_suspicious_activity(self, activity, ip="", student_id=None):
         """Record security events for monitoring"""
-        self.suspicious_activities.append({
-            'timestamp': datetime.now().isoformat(),
+        now = time.time()
+        event = {
+            'timestamp': datetime.fromtimestamp(now).isoformat(),
             'activity': activity,
-            'ip': '127.0.0.1'  # In production, get from request
-        })
+            'ip': ip or 'unknown',
+            'student_id': student_id
+        }
+        
+        with self._lock:
+            self.suspicious_activities.append(event)
+            self.ip_counters.add(event['ip'], now)
+            if student_id is not None:
+                self.student_counters.add(student_id, now)
+            
+            # Written by the flush_logs maintenance task, never on the request thread
+            if self.db:
+                self._pending_events.append(event)
+                self._cap_pending_locked()
+    
+    def flush_events(self):
+        """Persist pending security events"""
+        with self._lock:
+            events, self._pending_events = self._pending_events, []
+        if not self.db or not events:
+            return
         
-        # Keep only last 100 activities
-        self.suspicious_activities = self.suspicious_activities[-100:]
+        # The write happens outside the lock so requests and reports are never blocked on it
+        if not self.db.save_security_events(events):
+            with self._lock:
+                self._pending_events = events + self._pending_events
+                self._cap_pending_locked()
+    
+    def _cap_pending_locked(self):
+        """Drop the oldest unsaved events past the pending limit"""
+        overflow = len(self._pending_events) - Config.SECURITY_PENDING_LIMIT
+        if overflow > 0:
+            del self._pending_events[:overflow]
+            self.dropped_events += overflow
+    
+    def _restore_events(self):
+        """Reload recent events so history survives restarts"""
+        if not self.db:
+            return
+        
+        for event in self.db.load_security_events(self.suspicious_activities.capacity):
+            self.suspicious_activities.append(event)
+            try:
+                recorded = datetime.fromisoformat(event['timestamp']).timestamp()
+            except (TypeError, ValueError):
+                continue
+            self.ip_counters.add(event['ip'], recorded)
+            if event['student_id'] is not None:
+                self.student_counters.add(event['student_id'], recorded)
     
     def get_security_report(self):
         """Generate security report"""
-        return {
-            'total_suspicious_activities': len(self.suspicious_activities),
-            'active_qr_sessions': len(self.active_qr_sessions),
-            'recent_activities': self.suspicious_activities[-10:]
-        }
+        with self._lock:
+            return {
+                'total_suspicious_activities': self.suspicious_activities.total,
+                'active_qr_sessions': len(self.active_qr_sessions),
+                'recent_activities': self.suspicious_activities.recent(10),
+                'unsaved_events_dropped': self.dropped_events,
+                'window_seconds': self.ip_counters.window,
+                'top_ips': self.ip_counters.top(),
+                'top_students': self.student_counters.top()
+            }
     
     def cleanup_expired_sessions(self):
         """Clean up expired QR sessions"""
         current_time = time.time()
         expired_sessions = [
-            key for key, session in self.active_qr_sessions.items()
+            key for key, session in list(self.active_qr_sessions.items())
             if current_time > session['expires_at']
         ]
         
         for key in expired_sessions:
-            del self.active_qr_sessions[key]
+            self.active_qr_sessions.pop(key, None)
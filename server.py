@@ -1,38 +1,124 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 import urllib.parse as urlparse
+import html as html_lib
 import json
 import time
+from datetime import datetime, timezone
 from database import AdvancedDatabase
 from auth import AdvancedAuth
 from security import AdvancedSecurity
+from anticheat import AdvancedAntiCheat
+from analytics import AttendanceAnalytics
+from regenerator import QRImageCache
+from scheduler import MaintenanceScheduler
+from admission import AdmissionController, AdmissionRejected
+from tracing import TraceRecorder
 from config import Config
 
 class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
+    # Auth, security monitoring and analytics state is shared across requests
+    shared_auth = None
+    shared_security = None
+    shared_anticheat = None
+    shared_analytics = None
+    scheduler = None
+    admission = AdmissionController()
+    tracer = None
+    qr_images = QRImageCache()
+    
     def __init__(self, *args, **kwargs):
         self.db = AdvancedDatabase()
-        self.auth = AdvancedAuth()
-        self.security = AdvancedSecurity()
+        self.init_shared_state(self.db)
+        self.auth = AdvancedAttendanceHandler.shared_auth
+        self.security = AdvancedAttendanceHandler.shared_security
+        self.anticheat = AdvancedAttendanceHandler.shared_anticheat
+        self.analytics = AdvancedAttendanceHandler.shared_analytics
         super().__init__(*args, **kwargs)
     
+    @classmethod
+    def init_shared_state(cls, db):
+        """Create the state shared by every request"""
+        if cls.shared_security is None:
+            cls.shared_auth = AdvancedAuth()
+            cls.shared_security = AdvancedSecurity(db)
+            cls.shared_anticheat = AdvancedAntiCheat(db, cls.shared_security)
+            cls.shared_analytics = AttendanceAnalytics(db)
+    
     def do_GET(self):
         """Handle GET requests"""
+        self.dispatch_with_admission('GET', self.handle_get)
+    
+    def do_POST(self):
+        """Handle POST requests"""
+        self.dispatch_with_admission('POST', self.handle_post)
+    
+    def dispatch_with_admission(self, method, handler):
+        """Run handler once the route's admission slot is granted, else shed load"""
+        started = time.time()
+        self.response_status = None
+        # When tracing, read the body up front so shed requests keep their real shape;
+        # otherwise shed requests are rejected without reading it
+        self.request_body = self.read_request_body() if method == 'POST' and self.tracer else None
+        route_class = self.admission.classify(method, urlparse.urlparse(self.path).path)
+        try:
+            try:
+                self.admission.acquire(route_class)
+            except AdmissionRejected as e:
+                self.send_overloaded(e.retry_after)
+                return
+            
+            try:
+                handler()
+            finally:
+                self.admission.release(route_class)
+        finally:
+            if self.tracer:
+                self.record_trace(method, started)
+    
+    def read_request_body(self):
+        """Read and decode the request body"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            content_length = 0
+        return self.rfile.read(content_length).decode('utf-8', errors='replace')
+    
+    def record_trace(self, method, started):
+        """Add this request to the opt-in trace"""
+        parsed_path = urlparse.urlparse(self.path)
+        self.tracer.record(method, parsed_path.path, urlparse.parse_qs(parsed_path.query),
+                           self.request_body, self.get_current_session(), self.response_status,
+                           started, time.time() - started)
+    
+    def send_response(self, code, message=None):
+        """Send response status, remembering it for tracing"""
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def handle_get(self):
+        """Route GET requests"""
         try:
             parsed_path = urlparse.urlparse(self.path)
             path = parsed_path.path
             
+            # Handlers are looked up by name so a missing one only breaks its own route
             routes = {
-                '/': self.serve_login,
-                '/dashboard': self.serve_dashboard,
-                '/teacher': self.serve_teacher_dashboard,
-                '/student': self.serve_student_dashboard,
-                '/scanner': self.serve_qr_scanner,
-                '/report': self.serve_attendance_report,
-                '/security': self.serve_security_report,
-                '/logout': self.handle_logout
+                '/': 'serve_login',
+                '/dashboard': 'serve_dashboard',
+                '/teacher': 'serve_teacher_dashboard',
+                '/student': 'serve_student_dashboard',
+                '/scanner': 'serve_qr_scanner',
+                '/report': 'serve_attendance_report',
+                '/security': 'serve_security_report',
+                '/analytics': 'serve_analytics',
+                '/maintenance': 'serve_maintenance_stats',
+                '/logout': 'handle_logout'
             }
             
-            if path in routes:
-                routes[path]()
+            if path in routes and hasattr(self, routes[path]):
+                getattr(self, routes[path])()
+            elif path.startswith('/qr_image/'):
+                self.serve_qr_image(path.split('/')[-1])
             elif path.startswith('/generate_qr/'):
                 class_id = int(path.split('/')[-1])
                 self.generate_qr_code(class_id)
@@ -42,18 +128,23 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         except Exception as e:
             self.send_error(500, f"Server error: {str(e)}")
     
-    def do_POST(self):
-        """Handle POST requests"""
+    def handle_post(self):
+        """Route POST requests"""
         try:
-            content_length = int(self.headers.get('Content-Length', 0))
-            post_data = self.rfile.read(content_length).decode('utf-8')
+            if self.request_body is None:
+                self.request_body = self.read_request_body()
+            post_data = self.request_body
             
             if self.path == '/login':
                 self.handle_login(post_data)
             elif self.path == '/mark_attendance':
                 self.handle_mark_attendance(post_data)
+            elif self.path == '/mark_attendance_batch':
+                self.handle_mark_attendance_batch(post_data)
             elif self.path == '/create_session':
                 self.handle_create_session(post_data)
+            elif self.path == '/review_flag':
+                self.handle_review_flag(post_data)
             else:
                 self.send_error(404)
                 
@@ -129,39 +220,71 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         </div>
         
         <script>
-            async function submitAttendance() {{
+            // Retry 503 responses, honouring Retry-After with jittered exponential backoff
+            async function fetchWithBackoff(url, options, maxAttempts = 4) {
+                let response;
+                for (let attempt = 0; attempt < maxAttempts; attempt++) {
+                    response = await fetch(url, options);
+                    if (response.status !== 503 || attempt === maxAttempts - 1) {
+                        return response;
+                    }
+                    
+                    const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+                    const base = Math.max(retryAfter * 1000, 500 * Math.pow(2, attempt));
+                    await new Promise(resolve => setTimeout(resolve, base * (0.5 + Math.random())));
+                }
+                return response;
+            }
+            
+            // Random per-browser id, so students on the same phone model are told apart
+            function getDeviceId() {
+                let deviceId = localStorage.getItem('attendanceDeviceId');
+                if (!deviceId) {
+                    deviceId = Array.from(crypto.getRandomValues(new Uint8Array(16)),
+                                          byte => byte.toString(16).padStart(2, '0')).join('');
+                    localStorage.setItem('attendanceDeviceId', deviceId);
+                }
+                return deviceId;
+            }
+            
+            async function submitAttendance() {
                 const qrData = document.getElementById('qrInput').value;
                 const resultDiv = document.getElementById('result');
                 
-                if (!qrData) {{
+                if (!qrData) {
                     resultDiv.innerHTML = '<div class="error">Please enter QR code data</div>';
                     return;
-                }}
+                }
                 
-                try {{
-                    const response = await fetch('/mark_attendance', {{
+                try {
+                    const response = await fetchWithBackoff('/mark_attendance', {
                         method: 'POST',
-                        headers: {{ 'Content-Type': 'application/json' }},
-                        body: JSON.stringify({{ qr_data: qrData }})
-                    }});
+                        headers: { 'Content-Type': 'application/json' },
+                        body: JSON.stringify({ qr_data: qrData, device_id: getDeviceId() })
+                    });
+                    
+                    if (response.status === 503) {
+                        resultDiv.innerHTML = '<div class="error">⏳ Server is busy, please try again in a moment</div>';
+                        return;
+                    }
                     
                     const data = await response.json();
                     
-                    if (data.success) {{
+                    if (data.success) {
                         resultDiv.innerHTML = '<div class="success">✅ ' + data.message + '</div>';
                         document.getElementById('qrInput').value = '';
-                    }} else {{
+                    } else {
                         resultDiv.innerHTML = '<div class="error">❌ ' + data.error + '</div>';
-                    }}
-                }} catch (error) {{
+                    }
+                } catch (error) {
                     resultDiv.innerHTML = '<div class="error">❌ Network error</div>';
-                }}
-            }}
+                }
+            }
             
             // Enter key support
-            document.getElementById('qrInput').addEventListener('keypress', function(e) {{
+            document.getElementById('qrInput').addEventListener('keypress', function(e) {
                 if (e.key === 'Enter') submitAttendance();
-            }});
+            });
         </script>
         """
         
@@ -176,6 +299,9 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
             return
         
         qr_data = self.security.generate_secure_qr_data(class_id)
+        slot = self.security.current_qr_slot()
+        # Small grace so the request lands after the server has moved to the new slot
+        first_rotation_ms = int((slot + Config.QR_ROTATION_INTERVAL - time.time()) * 1000) + 250
         
         html = f"""
         <div class="card">
@@ -184,48 +310,133 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
             
             <div style="text-align: center; margin: 2rem 0;">
                 <div style="border: 3px solid #333; padding: 2rem; display: inline-block; background: white;">
-                    <div style="font-family: monospace; font-size: 18px; letter-spacing: 2px;">
+                    <img id="qrImage" src="/qr_image/{class_id}.svg?slot={slot}" alt="Attendance QR code"
+                         style="width: 320px; height: 320px;">
+                    <div id="qrText" style="font-family: monospace; font-size: 18px; letter-spacing: 2px;">
                         {qr_data}
                     </div>
                 </div>
             </div>
             
             <div style="background: #f8f9fa; padding: 1rem; border-radius: 5px;">
-                <strong>QR Data:</strong> <code>{qr_data}</code><br>
-                <strong>Expires:</strong> {time.strftime('%H:%M:%S', time.localtime(time.time() + 300))}
+                <strong>QR Data:</strong> <code id="qrData">{qr_data}</code><br>
+                <strong>Expires:</strong> <span id="qrExpires">{time.strftime('%H:%M:%S', time.localtime(slot + Config.QR_CODE_TIMEOUT))}</span>
             </div>
             
             <a href="/teacher" class="btn">Back to Dashboard</a>
         </div>
+        
+        <script>
+            // Swap to the next rotating code when its slot starts, keeping the text in step
+            const rotationInterval = {Config.QR_ROTATION_INTERVAL};
+            const codeTimeout = {Config.QR_CODE_TIMEOUT};
+            let imageUrl = null;
+            
+            async function rotateQr() {{
+                try {{
+                    const response = await fetch('/qr_image/{class_id}.svg?slot=' + Date.now(), {{ cache: 'no-store' }});
+                    if (!response.ok) return;
+                    const qrData = response.headers.get('X-QR-Data');
+                    const slot = parseInt(response.headers.get('X-QR-Slot'), 10);
+                    
+                    if (imageUrl) URL.revokeObjectURL(imageUrl);
+                    imageUrl = URL.createObjectURL(await response.blob());
+                    document.getElementById('qrImage').src = imageUrl;
+                    document.getElementById('qrText').textContent = qrData;
+                    document.getElementById('qrData').textContent = qrData;
+                    document.getElementById('qrExpires').textContent =
+                        new Date((slot + codeTimeout) * 1000).toLocaleTimeString();
+                }} catch (error) {{
+                    console.error('QR rotation failed:', error);
+                }}
+            }}
+            
+            // The first swap waits for the next slot boundary on the server's clock
+            setTimeout(() => {{
+                rotateQr();
+                setInterval(rotateQr, rotationInterval * 1000);
+            }}, {first_rotation_ms});
+        </script>
         """
         
         full_html = self.render_template('base.html', content=html, title="QR Code")
         self.send_html(full_html)
     
+    def serve_qr_image(self, filename):
+        """Serve the current rotating QR code as a cached SVG or PNG image"""
+        session = self.get_current_session()
+        if not session or session['role'] != 'teacher':
+            self.send_error(403, "Teacher authentication required")
+            return
+        
+        class_part, _, fmt = filename.partition('.')
+        if fmt not in QRImageCache.RENDERERS or not class_part.isdigit():
+            self.send_error(404, "Unknown QR image")
+            return
+        class_id = int(class_part)
+        
+        qr_data = self.security.generate_secure_qr_data(class_id)
+        token = qr_data.split(':')[2]
+        slot = self.security.current_qr_slot()
+        max_age = max(1, slot + Config.QR_ROTATION_INTERVAL - int(time.time()))
+        
+        if self.headers.get('If-None-Match') == f'"{token}"':
+            self.send_response(304)
+            self.send_header('ETag', f'"{token}"')
+            self.send_header('Cache-Control', f'private, max-age={max_age}')
+            self.end_headers()
+            return
+        
+        image = self.qr_images.get(qr_data, fmt)
+        
+        self.send_response(200)
+        self.send_header('Content-type', 'image/svg+xml' if fmt == 'svg' else 'image/png')
+        self.send_header('Content-Length', str(len(image)))
+        self.send_header('ETag', f'"{token}"')
+        self.send_header('Cache-Control', f'private, max-age={max_age}')
+        self.send_header('X-QR-Data', qr_data)
+        self.send_header('X-QR-Slot', str(slot))
+        self.end_headers()
+        self.wfile.write(image)
+        
+        # Render the next slot's code before projector screens ask for it
+        next_data = self.security.qr_data_for_slot(class_id, self.security.current_qr_slot(1))
+        self.qr_images.prerender([next_data], (fmt,))
+    
     def handle_mark_attendance(self, post_data):
         """Handle attendance marking request"""
         try:
             data = json.loads(post_data)
             qr_data = data.get('qr_data', '')
             
+            # Get current student session
+            student_session = self.get_current_session()
+            student_id = student_session['user_id'] if student_session else None
+            
             # Validate QR data
-            session, message = self.security.validate_qr_data(qr_data, self.get_client_ip())
+            session, message = self.security.validate_qr_data(qr_data, self.get_client_ip(), student_id)
             
             if not session:
                 response = {'success': False, 'error': message}
             else:
-                # Get current student session
-                student_session = self.get_current_session()
                 if not student_session or student_session['role'] != 'student':
                     response = {'success': False, 'error': 'Student authentication required'}
                 else:
                     # Mark attendance
+                    attendance_session_id = session['class_id']  # This should be session ID in real implementation
+                    client_ip = self.get_client_ip()
+                    device_info = self.headers.get('User-Agent', '')
                     success, message = self.db.mark_attendance(
-                        session['class_id'],  # This should be session ID in real implementation
+                        attendance_session_id,
                         student_session['user_id'],
-                        self.get_client_ip(),
-                        self.headers.get('User-Agent', '')
+                        client_ip,
+                        device_info
                     )
+                    
+                    # Feed the anti-cheat detector in-line
+                    if success:
+                        self.anticheat.observe(attendance_session_id, student_session['user_id'],
+                                               client_ip, self.get_device_id(data))
                     response = {'success': success, 'message': message}
             
         except Exception as e:
@@ -233,6 +444,88 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         
         self.send_json(response)
     
+    def handle_mark_attendance_batch(self, post_data):
+        """Handle a batch of queued offline scans in one transaction"""
+        try:
+            data = json.loads(post_data)
+            scans = data.get('scans', [])
+            if not isinstance(scans, list) or not scans:
+                self.send_json({'success': False, 'error': 'No scans submitted'})
+                return
+            if len(scans) > Config.BATCH_MAX_ITEMS:
+                self.send_json({'success': False,
+                                'error': f'Too many scans (max {Config.BATCH_MAX_ITEMS})'})
+                return
+            
+            student_session = self.get_current_session()
+            if not student_session or student_session['role'] != 'student':
+                self.send_json({'success': False, 'error': 'Student authentication required'})
+                return
+            
+            student_id = student_session['user_id']
+            client_ip = self.get_client_ip()
+            device_info = self.headers.get('User-Agent', '')
+            
+            results = [None] * len(scans)
+            pending = []
+            for index, scan in enumerate(scans):
+                scan = scan if isinstance(scan, dict) else {}
+                session, message = self.security.validate_offline_scan(
+                    scan.get('qr_data', ''), scan.get('scanned_at'), client_ip, student_id)
+                results[index] = {'scan_id': scan.get('scan_id'), 'success': False, 'error': message}
+                if session:
+                    pending.append((float(scan['scanned_at']), index, session))
+            
+            # Apply in scan order so records keep the original timeline
+            pending.sort()
+            items = [{
+                'session_id': session['class_id'],  # This should be session ID in real implementation
+                'student_id': student_id,
+                'recorded_at': datetime.fromtimestamp(scanned_at, timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+            } for scanned_at, _, session in pending]
+            
+            outcomes = self.db.mark_attendance_batch(items, client_ip, device_info) if items else []
+            session_ends = {}
+            for (scanned_at, index, session), (success, message) in zip(pending, outcomes):
+                results[index] = {'scan_id': results[index]['scan_id'], 'success': success}
+                results[index]['message' if success else 'error'] = message
+                if success:
+                    self.anticheat.observe(session['class_id'], student_id, client_ip,
+                                           self.get_device_id(data), now=scanned_at, live=False)
+                    
+                    # Catching up after class is routine; only flag submissions well after the session ended
+                    if session['class_id'] not in session_ends:
+                        session_ends[session['class_id']] = self.db.get_attendance_session_end(session['class_id'])
+                    session_end = session_ends[session['class_id']]
+                    if session_end and time.time() > session_end + Config.OFFLINE_SCAN_LATE_GRACE:
+                        self.anticheat.flag_late_scan(session['class_id'], student_id, client_ip,
+                                                      scanned_at, session_end)
+            
+            response = {'success': True, 'results': results}
+            
+        except Exception as e:
+            response = {'success': False, 'error': f'System error: {str(e)}'}
+        
+        self.send_json(response)
+    
+    def handle_review_flag(self, post_data):
+        """Mark an attendance anomaly flag as reviewed"""
+        session = self.get_current_session()
+        if not session or session['role'] != 'teacher':
+            self.send_json({'success': False, 'error': 'Teacher authentication required'})
+            return
+        
+        try:
+            flag_id = int(json.loads(post_data).get('flag_id'))
+            if self.db.mark_flag_reviewed(flag_id):
+                response = {'success': True, 'message': 'Flag marked as reviewed'}
+            else:
+                response = {'success': False, 'error': 'Flag not found'}
+        except (ValueError, TypeError) as e:
+            response = {'success': False, 'error': f'Invalid request: {str(e)}'}
+        
+        self.send_json(response)
+    
     def serve_attendance_report(self):
         """Serve attendance reports"""
         session = self.get_current_session()
@@ -241,6 +534,9 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
             return
         
         report = self.db.get_attendance_report(1)  # Class ID 1 for demo
+        if report is None:
+            self.send_busy_page("Attendance Report")
+            return
         
         html = """
         <div class="card">
@@ -282,6 +578,127 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         full_html = self.render_template('base.html', content=html, title="Attendance Report")
         self.send_html(full_html)
     
+    def serve_analytics(self):
+        """Serve attendance analytics as JSON"""
+        session = self.get_current_session()
+        if not session or session['role'] != 'teacher':
+            self.send_json({'success': False, 'error': 'Teacher authentication required'})
+            return
+        
+        params = urlparse.parse_qs(urlparse.urlparse(self.path).query)
+        view = params.get('view', ['weekly'])[0]
+        start_date = params.get('start', [None])[0]
+        end_date = params.get('end', [None])[0]
+        
+        try:
+            class_id = int(params.get('class_id', ['1'])[0])
+            if view == 'weekly':
+                data = self.analytics.weekly_trends(class_id, start_date, end_date)
+            elif view == 'heatmap':
+                data = self.analytics.heatmap(class_id, start_date, end_date)
+            elif view == 'at_risk':
+                threshold = float(params.get('threshold', [Config.ANALYTICS_AT_RISK_THRESHOLD])[0])
+                data = self.analytics.at_risk(class_id, threshold, start_date, end_date)
+            elif view == 'compare':
+                class_ids = [int(c) for c in params.get('class_ids', [str(class_id)])[0].split(',') if c]
+                data = self.analytics.compare_classes(class_ids, start_date, end_date)
+            else:
+                self.send_json({'success': False, 'error': f'Unknown view: {view}'})
+                return
+        except ValueError as e:
+            self.send_json({'success': False, 'error': f'Invalid request: {str(e)}'})
+            return
+        
+        if data is None:
+            self.send_json({'success': False, 'error': 'Analytics temporarily unavailable'})
+        else:
+            self.send_json({'success': True, 'view': view, 'data': data})
+    
+    def serve_maintenance_stats(self):
+        """Serve background maintenance task statistics as JSON"""
+        session = self.get_current_session()
+        if not session or session['role'] != 'teacher':
+            self.send_json({'success': False, 'error': 'Teacher authentication required'})
+            return
+        
+        stats = self.scheduler.get_stats() if self.scheduler else {}
+        self.send_json({'success': True, 'running': self.scheduler is not None, 'tasks': stats,
+                        'admission': self.admission.get_stats()})
+    
+    def serve_security_report(self):
+        """Serve security monitoring report"""
+        session = self.get_current_session()
+        if not session or session['role'] != 'teacher':
+            self.redirect_login()
+            return
+        
+        report = self.security.get_security_report()
+        window_minutes = report['window_seconds'] // 60
+        
+        offender_rows = ""
+        for ip, count in report['top_ips']:
+            offender_rows += f"<tr><td>IP</td><td>{html_lib.escape(str(ip))}</td><td style=\"text-align: center;\">{count}</td></tr>"
+        for student_id, count in report['top_students']:
+            offender_rows += f"<tr><td>Student</td><td>{student_id}</td><td style=\"text-align: center;\">{count}</td></tr>"
+        
+        flags = self.db.get_attendance_flags()
+        flag_rows = ""
+        if flags is None:
+            flag_rows = "<tr><td colspan=\"6\">⏳ Flags are temporarily unavailable, refresh in a few seconds</td></tr>"
+        for flag in flags or []:
+            flag_rows += (f"<tr><td>{flag['created_at']}</td><td>{flag['session_id']}</td>"
+                          f"<td>{flag['flag_type']}</td><td>{html_lib.escape(str(flag['flag_key']))}</td>"
+                          f"<td>{html_lib.escape(json.dumps(flag['details']))}</td>"
+                          f"<td><button class=\"btn\" onclick=\"reviewFlag({flag['id']})\">Reviewed</button></td></tr>")
+        
+        activity_rows = ""
+        for activity in reversed(report['recent_activities']):
+            activity_rows += f"<tr><td>{activity['timestamp']}</td><td>{html_lib.escape(str(activity['ip']))}</td><td>{html_lib.escape(activity['activity'])}</td></tr>"
+        
+        html = f"""
+        <div class="card">
+            <h2>🛡️ Security Monitor</h2>
+            <p>Total suspicious activities: {report['total_suspicious_activities']}</p>
+            <p>Active QR sessions: {report['active_qr_sessions']}</p>
+            <p>Unsaved events dropped: {report['unsaved_events_dropped']}</p>
+            
+            <h3>Top Offenders (last {window_minutes} minutes)</h3>
+            <table>
+                <thead><tr><th>Type</th><th>Source</th><th>Events</th></tr></thead>
+                <tbody>{offender_rows}</tbody>
+            </table>
+            
+            <h3>Attendance Flags</h3>
+            <table>
+                <thead><tr><th>Time</th><th>Session</th><th>Type</th><th>Source</th><th>Details</th><th></th></tr></thead>
+                <tbody>{flag_rows}</tbody>
+            </table>
+            
+            <h3>Recent Activities</h3>
+            <table>
+                <thead><tr><th>Time</th><th>IP</th><th>Activity</th></tr></thead>
+                <tbody>{activity_rows}</tbody>
+            </table>
+            
+            <a href="/teacher" class="btn">Back to Dashboard</a>
+        </div>
+        
+        <script>
+            async function reviewFlag(flagId) {{
+                const response = await fetch('/review_flag', {{
+                    method: 'POST',
+                    headers: {{ 'Content-Type': 'application/json' }},
+                    body: JSON.stringify({{ flag_id: flagId }})
+                }});
+                const data = await response.json();
+                if (data.success) window.location.reload();
+            }}
+        </script>
+        """
+        
+        full_html = self.render_template('base.html', content=html, title="Security Monitor")
+        self.send_html(full_html)
+    
     # Helper methods
     def get_current_session(self):
         """Get current user session from cookies"""
@@ -292,8 +709,24 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         return None
     
     def get_client_ip(self):
-        """Get client IP address"""
-        return self.headers.get('X-Forwarded-For', self.headers.get('X-Real-IP', '127.0.0.1'))
+        """Get client IP address, trusting proxy headers only from configured proxies"""
+        peer = self.client_address[0]
+        if peer not in Config.TRUSTED_PROXIES:
+            return peer
+        
+        # Walk the forwarding chain from the nearest hop, skipping our own proxies
+        forwarded = [hop.strip() for hop in self.headers.get('X-Forwarded-For', '').split(',') if hop.strip()]
+        for hop in reversed(forwarded):
+            if hop not in Config.TRUSTED_PROXIES:
+                return hop
+        return self.headers.get('X-Real-IP', '').strip() or peer
+    
+    def get_device_id(self, data):
+        """Device id the scanner keeps in local storage, or empty if missing or malformed"""
+        device_id = data.get('device_id') if isinstance(data, dict) else None
+        if not isinstance(device_id, str) or len(device_id) > Config.ANTICHEAT_DEVICE_ID_LENGTH:
+            return ''
+        return device_id
     
     def redirect_login(self):
         """Redirect to login page"""
@@ -308,6 +741,35 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(html.encode())
     
+    def send_busy_page(self, title):
+        """Send a 503 page asking the user to retry a busy report"""
+        html = f"""
+        <div class="card">
+            <h2>⏳ {title}</h2>
+            <p>Reports are temporarily unavailable. This page will retry in {Config.READ_BUSY_RETRY_AFTER} seconds.</p>
+            <a href="/teacher" class="btn">Back to Dashboard</a>
+        </div>
+        <script>setTimeout(() => window.location.reload(), {Config.READ_BUSY_RETRY_AFTER * 1000});</script>
+        """
+        body = self.render_template('base.html', content=html, title=title).encode()
+        self.send_response(503)
+        self.send_header('Content-type', 'text/html')
+        self.send_header('Retry-After', str(Config.READ_BUSY_RETRY_AFTER))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_overloaded(self, retry_after):
+        """Send a fast 503 telling the client when to retry"""
+        body = json.dumps({'success': False, 'error': 'Server busy, please retry shortly',
+                           'retry_after': retry_after}).encode()
+        self.send_response(503)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Retry-After', str(retry_after))
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+    
     def send_json(self, data):
         """Send JSON response"""
         self.send_response(200)
@@ -351,15 +813,56 @@ class AdvancedAttendanceHandler(BaseHTTPRequestHandler):
         )
         return base_html
 
+def create_scheduler(db, close_sessions_now=True):
+    """Build the background maintenance scheduler for the shared state"""
+    handler = AdvancedAttendanceHandler
+    handler.init_shared_state(db)
+    scheduler = MaintenanceScheduler()
+    
+    def refresh_summaries():
+        for class_id in db.get_class_ids():
+            handler.shared_analytics.student_rates(class_id)
+    
+    def flush_logs():
+        db.flush_logs()
+        handler.shared_security.flush_events()
+        if handler.tracer:
+            handler.tracer.flush()
+    
+    scheduler.add_task('expire_auth_sessions', handler.shared_auth.cleanup_sessions,
+                       Config.AUTH_CLEANUP_INTERVAL)
+    scheduler.add_task('expire_qr_sessions', handler.shared_security.cleanup_expired_sessions,
+                       Config.QR_CLEANUP_INTERVAL)
+    scheduler.add_task('close_attendance_sessions', db.close_expired_attendance_sessions,
+                       Config.SESSION_CLOSE_INTERVAL, run_now=close_sessions_now)
+    scheduler.add_task('refresh_summaries', refresh_summaries, Config.SUMMARY_REFRESH_INTERVAL)
+    scheduler.add_task('flush_logs', flush_logs, Config.LOG_FLUSH_INTERVAL)
+    scheduler.add_task('prune_security_events', db.prune_security_events, Config.SECURITY_PRUNE_INTERVAL)
+    return scheduler
+
 def run_server():
     """Start the advanced attendance server"""
-    server = HTTPServer((Config.SERVER_HOST, Config.SERVER_PORT), AdvancedAttendanceHandler)
+    db = AdvancedDatabase()
+    if Config.TRACE_ENABLED:
+        AdvancedAttendanceHandler.tracer = TraceRecorder()
+        print(f"🎞️ Recording request trace to {AdvancedAttendanceHandler.tracer.path}")
+    scheduler = create_scheduler(db)
+    AdvancedAttendanceHandler.scheduler = scheduler
+    scheduler.start()
+    
+    server = ThreadingHTTPServer((Config.SERVER_HOST, Config.SERVER_PORT), AdvancedAttendanceHandler)
     print(f"🚀 Advanced Attendance System running on http://{Config.SERVER_HOST}:{Config.SERVER_PORT}")
     print(f"📝 {Config.SYSTEM_MANAGER}")
     print("\nDemo Accounts:")
     print("Teacher: teacher1 / teacher123")
     print("Student: student1 / student123")
-    server.serve_forever()
+    try:
+        server.serve_forever()
+    finally:
+        scheduler.stop()
+        flush_logs = scheduler.tasks.get('flush_logs')
+        if flush_logs:
+            scheduler.run_task(flush_logs)
 
 if __name__ == '__main__':
     run_server()
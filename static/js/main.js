@@ -22,6 +22,9 @@ class AttendanceSystem {
         // QR scanner functionality
         this.setupQRScanner();
 
+        // Offline scan queue
+        this.setupOfflineQueue();
+
         // Real-time updates
         this.startRealTimeUpdates();
 
@@ -108,15 +111,35 @@ class AttendanceSystem {
     }
 
     async submitAttendance(qrData) {
+        const scannedAt = Date.now() / 1000;
+
+        if (!navigator.onLine) {
+            this.queueScan(qrData, scannedAt);
+            return;
+        }
+
+        let response;
         try {
-            const response = await fetch('/mark_attendance', {
+            response = await this.fetchWithBackoff('/mark_attendance', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ qr_data: qrData })
+                body: JSON.stringify({ qr_data: qrData, device_id: this.getDeviceId() })
             });
+        } catch (error) {
+            // fetch only rejects on network failure; keep the original scan time so it can be validated later
+            this.queueScan(qrData, scannedAt);
+            return;
+        }
 
+        // Still overloaded after retrying - send later with the batch queue
+        if (response.status === 503) {
+            this.queueScan(qrData, scannedAt);
+            return;
+        }
+
+        try {
             const result = await response.json();
 
             if (result.success) {
@@ -135,8 +158,120 @@ class AttendanceSystem {
                 this.showNotification('❌ ' + result.error, 'error');
             }
         } catch (error) {
-            this.showNotification('❌ Network error. Please try again.', 'error');
+            // A non-JSON reply is a server error page; show it rather than queueing the scan
+            this.showNotification(`❌ Server error (${response.status}). Please try again.`, 'error');
+            console.error('Attendance submission error:', error);
+        }
+    }
+
+    setupOfflineQueue() {
+        this.offlineQueueKey = 'attendanceScanQueue';
+        this.batchSize = 50;
+        this.flushingQueue = false;
+
+        window.addEventListener('online', () => this.flushScanQueue());
+        setInterval(() => this.flushScanQueue(), 60000);
+        this.flushScanQueue();
+    }
+
+    getDeviceId() {
+        // Random per-browser id, so students on the same phone model are told apart
+        let deviceId = localStorage.getItem('attendanceDeviceId');
+        if (!deviceId) {
+            deviceId = Array.from(crypto.getRandomValues(new Uint8Array(16)),
+                                  byte => byte.toString(16).padStart(2, '0')).join('');
+            localStorage.setItem('attendanceDeviceId', deviceId);
+        }
+        return deviceId;
+    }
+
+    loadScanQueue() {
+        try {
+            return JSON.parse(localStorage.getItem(this.offlineQueueKey)) || [];
+        } catch (error) {
+            return [];
+        }
+    }
+
+    saveScanQueue(queue) {
+        localStorage.setItem(this.offlineQueueKey, JSON.stringify(queue));
+    }
+
+    queueScan(qrData, scannedAt) {
+        const queue = this.loadScanQueue();
+        if (!queue.some(scan => scan.qr_data === qrData)) {
+            queue.push({
+                scan_id: `${Math.round(scannedAt * 1000)}-${queue.length}`,
+                qr_data: qrData,
+                scanned_at: scannedAt
+            });
+            this.saveScanQueue(queue);
+        }
+
+        const qrInput = document.getElementById('qrInput');
+        if (qrInput) qrInput.value = '';
+        this.showNotification('📥 Offline - scan saved and will be sent when connection returns.', 'warning');
+    }
+
+    async flushScanQueue() {
+        if (this.flushingQueue || !navigator.onLine) return;
+
+        let queue = this.loadScanQueue();
+        if (!queue.length) return;
+
+        this.flushingQueue = true;
+        let marked = 0;
+        try {
+            while (queue.length) {
+                const batch = queue.slice(0, this.batchSize);
+                const response = await this.fetchWithBackoff('/mark_attendance_batch', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({ scans: batch, device_id: this.getDeviceId() })
+                });
+
+                // Server is shedding load; keep the queue for the next flush
+                if (response.status === 503) break;
+
+                const result = await response.json();
+                if (!result.success) {
+                    this.showNotification('❌ ' + result.error, 'error');
+                    break;
+                }
+
+                // Every item gets a definitive result, so drop the whole batch
+                marked += result.results.filter(item => item.success).length;
+                queue = queue.slice(batch.length);
+                this.saveScanQueue(queue);
+            }
+        } catch (error) {
+            console.error('Queued scan submission failed:', error);
+        } finally {
+            this.flushingQueue = false;
+        }
+
+        if (marked) {
+            this.showNotification(`✅ ${marked} queued scan(s) marked successfully!`, 'success');
+        }
+    }
+
+    async fetchWithBackoff(url, options, maxAttempts = 4) {
+        // Retry 503 responses, honouring Retry-After with jittered exponential backoff
+        let response;
+        for (let attempt = 0; attempt < maxAttempts; attempt++) {
+            response = await fetch(url, options);
+            if (response.status !== 503 || attempt === maxAttempts - 1) {
+                return response;
+            }
+
+            const retryAfter = parseFloat(response.headers.get('Retry-After')) || 1;
+            const base = Math.max(retryAfter * 1000, 500 * Math.pow(2, attempt));
+            const delay = base * (0.5 + Math.random());
+            await new Promise(resolve => setTimeout(resolve, delay));
         }
+        return response;
     }
 
     animateSuccess() {
@@ -0,0 +1,98 @@
+import gzip
+import json
+import re
+import threading
+import time
+from config import Config
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|\.|$)')
+
+def route_template(path):
+    """Replace numeric path segments so routes group and carry no identifiers"""
+    return _ID_SEGMENT.sub('/<id>', path)
+
+def value_shape(value):
+    """Describe a value by type and size only"""
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'num'
+    if isinstance(value, str):
+        return f'str:{len(value)}'
+    if isinstance(value, list):
+        return {'list': len(value), 'item': value_shape(value[0]) if value else None}
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in sorted(value.items())}
+    return 'null' if value is None else type(value).__name__
+
+def body_shape(body):
+    """Shape of a request body without any of its values"""
+    if not body:
+        return None
+    try:
+        return value_shape(json.loads(body))
+    except ValueError:
+        return f'raw:{len(body)}'
+
+def load_trace(path):
+    """Read every record from a trace file"""
+    with gzip.open(path, 'rt') as trace_file:
+        return [json.loads(line) for line in trace_file if line.strip()]
+
+class TraceRecorder:
+    """Opt-in recorder of anonymised request streams to a gzip JSON-lines file"""
+    
+    def __init__(self, path=Config.TRACE_FILE, flush_batch=Config.TRACE_FLUSH_BATCH):
+        self.started = time.time()
+        self.path = path.format(started=int(self.started))
+        self.flush_batch = flush_batch
+        self._pending = []
+        self._actors = {}
+        self._role_counts = {}
+        self._lock = threading.Lock()
+    
+    def _actor(self, session):
+        """Stable per-trace pseudonym for the user behind a session"""
+        if not session:
+            return None
+        key = (session['role'], session['user_id'])
+        if key not in self._actors:
+            count = self._role_counts.get(session['role'], 0) + 1
+            self._role_counts[session['role']] = count
+            self._actors[key] = f"{session['role'][0]}{count}"
+        return self._actors[key]
+    
+    def record(self, method, path, query, body, session, status, started, duration):
+        """Add one request to the trace"""
+        entry = {
+            't': round(started - self.started, 4),
+            'm': method,
+            'r': route_template(path),
+            'q': {key: values[0] for key, values in query.items() if key in Config.TRACE_QUERY_KEYS},
+            'b': body_shape(body),
+            'role': session['role'] if session else None,
+            's': status,
+            'd': round(duration * 1000, 3)
+        }
+        with self._lock:
+            entry['a'] = self._actor(session)
+            self._pending.append(entry)
+            if len(self._pending) >= self.flush_batch:
+                self._flush_locked()
+    
+    def flush(self):
+        """Append pending records to the trace file"""
+        with self._lock:
+            self._flush_locked()
+    
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        try:
+            # Each flush appends a gzip member; readers see one continuous stream
+            with gzip.open(self.path, 'at') as trace_file:
+                for entry in self._pending:
+                    trace_file.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self._pending = []
+        except OSError as e:
+            print(f"Trace write error: {e}")